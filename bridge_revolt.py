@@ -51,6 +51,8 @@ from revolt.ext import commands as rv_commands
 from revolt.ext.commands import Command, Group
 import asyncio
 import aiohttp
+import contextvars
+import heapq
 import revolt
 import traceback
 import time
@@ -75,6 +77,18 @@ restrictions_legacy = r_legacy.Restrictions()
 mentions = nextcord.AllowedMentions(everyone=False, roles=False, users=False)
 cog_tokenstore = None
 
+# Set by RevoltPlatform while sending a bridged copy, so retries of the same copy can't create duplicates
+idempotency_key = contextvars.ContextVar('revolt_idempotency_key', default=None)
+
+# Set by RevoltPlatform around outbound calls, so the rate limiter can tell it when a call is being held back
+pacing = contextvars.ContextVar('revolt_pacing', default=None)
+
+# Set by the rate limiter after each response, to how long a 429 asked us to wait if it said
+retry_after = contextvars.ContextVar('revolt_retry_after', default=None)
+
+# Set by on_message around a fan-out, so RevoltPlatform can register each copy on the parent as soon as it's sent
+fanout_parent = contextvars.ContextVar('revolt_fanout_parent', default=None)
+
 def timetoint(t):
     try:
         return int(t)
@@ -201,6 +215,705 @@ def genid():
         value = '{0}{1}'.format(value, letter)
     return value
 
+class RoomIndex:
+    """Maps (server ID, channel ID) pairs to the room they're bound to."""
+
+    def __init__(self, bot, compatibility_mode=False):
+        self.bot = bot
+        self.compatibility_mode = compatibility_mode
+        self._channels = {}
+        self._rooms = {}
+        self._room_count = 0
+
+    def _roomkey(self):
+        return 'rooms_revolt' if self.compatibility_mode else 'rooms'
+
+    def _connections(self, room):
+        try:
+            if self.compatibility_mode:
+                return self.bot.db['rooms_revolt'][room]
+            else:
+                return self.bot.db['rooms'][room]['revolt']
+        except (KeyError, TypeError):
+            return {}
+
+    @staticmethod
+    def _channel_ids(channels):
+        if type(channels) is list:
+            return [f'{channel}' for channel in channels]
+        return [f'{channels}']
+
+    def _index_room(self, room):
+        entries = []
+        for server_id, channels in self._connections(room).items():
+            for channel_id in self._channel_ids(channels):
+                key = (f'{server_id}', channel_id)
+                self._channels.update({key: room})
+                entries.append(key)
+        self._rooms.update({room: entries})
+
+    def rebuild(self):
+        self._channels = {}
+        self._rooms = {}
+        for room in self.bot.db[self._roomkey()]:
+            self._index_room(room)
+        self._room_count = len(self.bot.db[self._roomkey()])
+
+    def drop(self, room):
+        for key in self._rooms.pop(room, []):
+            if self._channels.get(key) == room:
+                self._channels.pop(key)
+        self._room_count = len(self.bot.db[self._roomkey()])
+
+    def sync(self, room):
+        """Re-reads a single room's connections from the database."""
+        self.drop(room)
+        if room in self.bot.db[self._roomkey()]:
+            self._index_room(room)
+        self._room_count = len(self.bot.db[self._roomkey()])
+
+    def rename(self, room, newroom):
+        self.drop(room)
+        self.sync(newroom)
+
+    def get(self, server_id, channel_id):
+        # Rooms can also be created or deleted from Discord, so rebuild if the room count has drifted
+        if len(self.bot.db[self._roomkey()]) != self._room_count:
+            self.rebuild()
+
+        key = (f'{server_id}', f'{channel_id}')
+        room = self._channels.get(key)
+        if not room:
+            return None
+
+        # Validate the hit, as the room may have been renamed or the server removed from elsewhere
+        channels = self._connections(room).get(f'{server_id}')
+        if not channels or not f'{channel_id}' in self._channel_ids(channels):
+            self.rebuild()
+            return self._channels.get(key)
+        return room
+
+class DatabaseWriter:
+    """Coalesces database saves into periodic writes that run off the event loop.
+
+    Single-key changes can be recorded in an append-only journal instead, which is replayed on boot and
+    compacted into a full snapshot once it grows too large or too old."""
+
+    def __init__(self, bot, logger, interval=5, journal_path='revolt_journal.jsonl', compact_size=1048576,
+                 compact_interval=600):
+        self.bot = bot
+        self.logger = logger
+        self.interval = interval
+        self.journal_path = journal_path
+        self.compact_size = compact_size
+        self.compact_interval = compact_interval
+        self._pending = 0
+        self._dirty = False
+        self._journal_buffer = []
+        self._journal_size = 0
+        self._last_snapshot = time.time()
+        self._task = None
+        self._lock = asyncio.Lock()
+
+        # Metrics
+        self.mutations = 0
+        self.writes = 0
+        self.snapshots = 0
+        self.failures = 0
+        self.last_latency = 0
+        self.max_latency = 0
+        self.total_latency = 0
+
+    def _schedule(self):
+        self._pending += 1
+        self.mutations += 1
+        if not self._task or self._task.done():
+            self._task = asyncio.create_task(self._delayed_flush())
+
+    def mark_dirty(self):
+        """Marks the database as modified. The next write will save a full snapshot."""
+        self._dirty = True
+        self._schedule()
+
+    def record(self, op, path, value=None):
+        """Records a change to a single key in the journal.
+
+        Supported ops are set and delete for dict keys, and add and remove for list items."""
+        self._journal_buffer.append(json.dumps({'op': op, 'path': path, 'value': value, 'time': time.time()}))
+        self._schedule()
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(self.interval)
+        try:
+            await self.flush()
+        except:
+            self.logger.exception('Could not save database, retrying on next write')
+
+    def _apply(self, entry):
+        *parents, key = entry['path']
+        target = self.bot.db
+        for parent in parents:
+            target = target[parent]
+
+        if entry['op'] == 'set':
+            target[key] = entry['value']
+        elif entry['op'] == 'delete':
+            target.pop(key, None)
+        elif entry['op'] == 'add':
+            if not entry['value'] in target[key]:
+                target[key].append(entry['value'])
+        elif entry['op'] == 'remove':
+            if entry['value'] in target[key]:
+                target[key].remove(entry['value'])
+
+    def _saved_at(self):
+        """Returns when the database file was last saved, by us or by anything else calling save_data."""
+        try:
+            return os.path.getmtime(getattr(self.bot.db, 'file_path', 'data.json'))
+        except OSError:
+            return 0
+
+    async def replay(self):
+        """Applies journaled changes that haven't made it into a snapshot yet."""
+        def load():
+            try:
+                with open(self.journal_path, 'rb') as file:
+                    return file.readlines()
+            except FileNotFoundError:
+                return []
+
+        lines = await self.bot.loop.run_in_executor(None, load)
+        saved_at = self._saved_at()
+        applied = 0
+        for line in lines:
+            try:
+                entry = json.loads(line)
+                if entry.get('time', 0) <= saved_at:
+                    # Already in the saved database, and may since have been changed from elsewhere
+                    continue
+                self._apply(entry)
+                applied += 1
+            except (ValueError, KeyError, TypeError, AttributeError):
+                # Torn writes from a crash or entries for keys that no longer exist
+                continue
+
+        self._journal_size = sum(len(line) for line in lines)
+        return applied
+
+    def _append(self, lines):
+        data = ('\n'.join(lines) + '\n').encode('utf-8')
+        with open(self.journal_path, 'ab') as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        self._journal_size += len(data)
+
+    def _snapshot(self):
+        self.bot.db.save_data()
+
+        # Everything in the journal is now part of the snapshot
+        with open(self.journal_path, 'wb'):
+            pass
+        self._journal_size = 0
+        self._last_snapshot = time.time()
+
+    async def flush(self, snapshot=False):
+        """Writes all pending changes to disk now."""
+        async with self._lock:
+            if self._pending == 0 and not (snapshot and self._journal_size > 0):
+                return
+
+            pending = self._pending
+            lines = self._journal_buffer
+            dirty = self._dirty
+            self._pending = 0
+            self._journal_buffer = []
+            self._dirty = False
+
+            snapshot = snapshot or dirty or self._journal_size >= self.compact_size or (
+                self._journal_size > 0 and time.time() - self._last_snapshot >= self.compact_interval
+            )
+
+            started = time.time()
+            try:
+                if snapshot:
+                    await self.bot.loop.run_in_executor(None, self._snapshot)
+                else:
+                    await self.bot.loop.run_in_executor(None, lambda: self._append(lines))
+            except:
+                self._pending += pending
+                self._journal_buffer = lines + self._journal_buffer
+                self._dirty = self._dirty or dirty
+                self.failures += 1
+                raise
+
+            latency = time.time() - started
+            self.writes += 1
+            if snapshot:
+                self.snapshots += 1
+            self.last_latency = latency
+            self.total_latency += latency
+            if latency > self.max_latency:
+                self.max_latency = latency
+
+    async def close(self):
+        await self.flush(snapshot=True)
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def metrics(self):
+        return {
+            'pending': self._pending,
+            'mutations': self.mutations,
+            'writes': self.writes,
+            'snapshots': self.snapshots,
+            'coalesced': self.mutations - self._pending - self.writes,
+            'failures': self.failures,
+            'journal_size': self._journal_size,
+            'last_latency': self.last_latency,
+            'max_latency': self.max_latency,
+            'avg_latency': self.total_latency / self.writes if self.writes else 0
+        }
+
+class BanIndex:
+    """Checks global bans and expires them in the background."""
+
+    def __init__(self, bot, interval=30):
+        self.bot = bot
+        self.interval = interval
+        self._heap = []
+        self._tracked = {}
+        self._size = 0
+        self._task = None
+        self.persistence = None
+
+    def _track(self, target, expiry):
+        # Permanent bans (expiry of 0) never need to be swept
+        if not expiry or self._tracked.get(target) == expiry:
+            return
+        self._tracked.update({target: expiry})
+        heapq.heappush(self._heap, (expiry, target))
+
+    def rebuild(self):
+        self._tracked = {target: expiry for target, expiry in self.bot.db['banned'].items() if expiry}
+        self._heap = [(expiry, target) for target, expiry in self._tracked.items()]
+        heapq.heapify(self._heap)
+        self._size = len(self.bot.db['banned'])
+
+    def is_banned(self, target):
+        target = f'{target}'
+        expiry = self.bot.db['banned'].get(target)
+        if expiry is None:
+            return False
+        self._track(target, expiry)
+        return expiry == 0 or time.time() < expiry
+
+    def sweep(self):
+        """Removes expired bans from the database. Returns the number of bans removed."""
+        now = time.time()
+        removed = 0
+        while self._heap and self._heap[0][0] <= now:
+            expiry, target = heapq.heappop(self._heap)
+            if self._tracked.get(target) == expiry:
+                self._tracked.pop(target)
+
+            # Skip bans that have since been lifted or extended
+            if self.bot.db['banned'].get(target) == expiry:
+                self.bot.db['banned'].pop(target)
+                removed += 1
+        self._size = len(self.bot.db['banned'])
+        return removed
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+
+            # Bans can also be issued from other platforms
+            if len(self.bot.db['banned']) != self._size:
+                self.rebuild()
+
+            if self.sweep() > 0:
+                self.persistence.mark_dirty()
+
+    def start(self):
+        if self._task and not self._task.done():
+            return
+        self.rebuild()
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+class PermissionCache:
+    """Caches computed member permissions per server and channel until an update event invalidates them."""
+
+    def __init__(self, max_size=20000):
+        self.max_size = max_size
+        self._cache = {}
+        self._servers = {}
+
+    def get(self, server_id, channel_id, member_id):
+        return self._cache.get((server_id, channel_id, member_id))
+
+    def put(self, server_id, channel_id, member_id, permissions):
+        if len(self._cache) >= self.max_size:
+            # Evict the oldest entry
+            self._discard(next(iter(self._cache)))
+        key = (server_id, channel_id, member_id)
+        self._cache.update({key: permissions})
+        self._servers.setdefault(server_id, set()).add(key)
+
+    def permissions(self, member, channel=None):
+        """Returns the member's permissions in the server, or in the channel if one is given."""
+        channel_id = channel.id if channel else None
+        permissions = self.get(member.server.id, channel_id, member.id)
+        if permissions is None:
+            if channel:
+                permissions = member.get_channel_permissions(channel)
+            else:
+                permissions = member.get_permissions()
+            self.put(member.server.id, channel_id, member.id, permissions)
+        return permissions
+
+    def _discard(self, key):
+        self._cache.pop(key, None)
+        keys = self._servers.get(key[0])
+        if keys:
+            keys.discard(key)
+            if not keys:
+                self._servers.pop(key[0])
+
+    def clear(self):
+        self._cache = {}
+        self._servers = {}
+
+    def invalidate_server(self, server_id):
+        for key in self._servers.pop(server_id, set()):
+            self._cache.pop(key, None)
+
+    def invalidate_channel(self, server_id, channel_id):
+        for key in [key for key in self._servers.get(server_id, set()) if key[1] == channel_id]:
+            self._discard(key)
+
+    def invalidate_member(self, server_id, member_id):
+        for key in [key for key in self._servers.get(server_id, set()) if key[2] == member_id]:
+            self._discard(key)
+
+class IdentityCache:
+    """Caches fetched users, channels and servers for a while. IDs that Revolt says don't exist are remembered
+    too, so a mention of a deleted channel doesn't cost an API call every time it's bridged."""
+
+    missing = object()
+
+    def __init__(self, ttl=300, negative_ttl=120, max_size=20000):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self._cache = {}
+
+        # Metrics
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    def get(self, kind, object_id):
+        """Returns the cached object, IdentityCache.missing if it's known not to exist, or None."""
+        entry = self._cache.get((kind, object_id))
+        if not entry or entry[0] <= time.monotonic():
+            if entry:
+                self._cache.pop((kind, object_id))
+            self.misses += 1
+            return None
+
+        if entry[1] is self.missing:
+            self.negative_hits += 1
+        else:
+            self.hits += 1
+        return entry[1]
+
+    def _put(self, kind, object_id, value, ttl):
+        if len(self._cache) >= self.max_size:
+            # Evict the oldest entry
+            self._cache.pop(next(iter(self._cache)))
+        self._cache.pop((kind, object_id), None)
+        self._cache.update({(kind, object_id): (time.monotonic() + ttl, value)})
+
+    def put(self, kind, object_id, value):
+        self._put(kind, object_id, value, self.ttl)
+
+    def put_missing(self, kind, object_id):
+        self._put(kind, object_id, self.missing, self.negative_ttl)
+
+    def invalidate(self, kind, object_id):
+        self._cache.pop((kind, object_id), None)
+
+class SingleFlight:
+    """Lets concurrent requests for the same object share one in-flight call instead of each making their own."""
+
+    def __init__(self):
+        self._calls = {}
+
+        # Metrics
+        self.calls = 0
+        self.saved = {}
+
+    def run(self, key, func):
+        """Runs func, or joins the call already running for key. The first item of key names the kind of
+        request, and is used for metrics."""
+        task = self._calls.get(key)
+        if task:
+            self.saved.update({key[0]: self.saved.get(key[0], 0) + 1})
+        else:
+            task = asyncio.ensure_future(func())
+            self._calls.update({key: task})
+            self.calls += 1
+
+            def done(_task):
+                if self._calls.get(key) is task:
+                    self._calls.pop(key)
+                if not task.cancelled():
+                    # Everyone waiting may have been cancelled, don't let the exception go unretrieved
+                    task.exception()
+
+            task.add_done_callback(done)
+
+        # Shielded, so one caller being cancelled doesn't cancel the call for everyone else
+        return asyncio.shield(task)
+
+# Precomputed so classifying a reaction is a single set lookup
+unicode_emojis = frozenset(getattr(pymoji, 'EMOJI_DATA', {}).keys())
+
+def is_unicode_emoji(value):
+    if value in unicode_emojis:
+        return True
+    elif len(value) == 26 and value.isalnum():
+        # Custom emoji ID
+        return False
+    return pymoji.is_emoji(value)
+
+class EmojiCache:
+    """Remembers the names of custom emojis by ID, so reactions don't need to fetch them."""
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._names = {}
+
+    def get(self, emoji_id):
+        return self._names.get(emoji_id)
+
+    def put(self, emoji_id, name):
+        if len(self._names) >= self.max_size and not emoji_id in self._names:
+            # Evict the oldest entry
+            self._names.pop(next(iter(self._names)))
+        self._names.update({emoji_id: name})
+
+    def __len__(self):
+        return len(self._names)
+
+class ReactionAggregator:
+    """Batches reaction events per message over a short window before they're bridged.
+
+    A user adding and removing the same reaction within the window cancels out, so only the net change per user
+    is forwarded. Batches for the same message are forwarded in order."""
+
+    def __init__(self, forward, window=0.3):
+        self.forward = forward
+        self.window = window
+        self._pending = {}
+        self._tails = {}
+
+        # Metrics
+        self.events = 0
+        self.forwarded = 0
+
+    def add(self, message_id, emoji_id, user_id, added):
+        self.events += 1
+        batch = self._pending.get(message_id)
+        if batch is None:
+            batch = {}
+            self._pending.update({message_id: batch})
+            asyncio.get_running_loop().call_later(self.window, self._flush, message_id)
+
+        key = (emoji_id, user_id)
+        net = max(-1, min(1, batch.pop(key, 0) + (1 if added else -1)))
+        if net:
+            batch.update({key: net})
+
+    def _flush(self, message_id):
+        batch = self._pending.pop(message_id, None)
+        if not batch:
+            return
+        reactions = [(emoji_id, user_id, net > 0) for (emoji_id, user_id), net in batch.items()]
+        self.forwarded += len(reactions)
+        previous = self._tails.get(message_id)
+
+        async def forward():
+            if previous:
+                # Wait for the message's previous batch, so reactions are bridged in the order they happened
+                await asyncio.wait([previous])
+            await self.forward(message_id, reactions)
+
+        task = asyncio.create_task(forward())
+        self._tails.update({message_id: task})
+
+        def done(_task):
+            if self._tails.get(message_id) is task:
+                self._tails.pop(message_id)
+
+        task.add_done_callback(done)
+
+def idempotency_trace_config():
+    """Returns an aiohttp trace config that adds the current idempotency key to message sends."""
+    config = aiohttp.TraceConfig()
+
+    async def on_request_start(_session, _context, params):
+        key = idempotency_key.get()
+        if key and params.method == 'POST' and (
+                params.url.path.endswith('/messages') or '/webhooks/' in params.url.path
+        ):
+            params.headers['Idempotency-Key'] = key
+
+    config.on_request_start.append(on_request_start)
+    return config
+
+class RateLimitBucket:
+    def __init__(self, limit, remaining, reset_at, window):
+        self.limit = limit
+        self.remaining = remaining
+        self.reset_at = reset_at
+        self.window = window
+
+class RateLimiter:
+    """Paces Revolt API requests using the rate limit headers Revolt returns.
+
+    Buckets are discovered from the X-RateLimit-Bucket header, so routes that share a bucket are paced together."""
+
+    def __init__(self):
+        self._routes = {}
+        self._buckets = {}
+
+        # Metrics
+        self.requests = 0
+        self.delayed = 0
+        self.ratelimited = 0
+
+    @staticmethod
+    def route(method, url):
+        """Returns a route key for a request. The first ID is kept, as Revolt scopes buckets to it."""
+        parts = []
+        resource = None
+        for part in url.path.strip('/').split('/'):
+            if len(part) == 26 and part.isalnum():
+                if resource:
+                    part = ':id'
+                else:
+                    resource = part
+            elif resource and 'webhooks' in parts:
+                # Keep webhook tokens out of route keys
+                part = ':token'
+            parts.append(part)
+        return f'{method} {url.host}/{"/".join(parts)}', resource
+
+    async def acquire(self, route):
+        self.requests += 1
+        bucket = self._buckets.get(self._routes.get(route))
+        if not bucket:
+            # Unknown route, the response will tell us which bucket it belongs to
+            return
+
+        while True:
+            now = time.monotonic()
+            if now >= bucket.reset_at:
+                bucket.remaining = bucket.limit
+                bucket.reset_at = now + bucket.window
+            if bucket.remaining > 0:
+                bucket.remaining -= 1
+                return
+            self.delayed += 1
+            waiter = pacing.get()
+            if waiter:
+                await waiter.wait(bucket.reset_at - now)
+            else:
+                await asyncio.sleep(bucket.reset_at - now)
+
+    def update(self, route, status, headers):
+        name = headers.get('X-RateLimit-Bucket')
+        if not name:
+            return
+
+        try:
+            limit = int(headers['X-RateLimit-Limit'])
+            remaining = int(headers['X-RateLimit-Remaining'])
+            reset_after = int(headers['X-RateLimit-Reset-After']) / 1000
+        except (KeyError, ValueError):
+            return
+
+        key = (name, route[1])
+        self._routes.update({route: key})
+        reset_at = time.monotonic() + reset_after
+        bucket = self._buckets.get(key)
+        if not bucket:
+            bucket = RateLimitBucket(limit, remaining, reset_at, reset_after)
+            self._buckets.update({key: bucket})
+        else:
+            bucket.limit = limit
+            bucket.window = max(bucket.window, reset_after)
+            if reset_at > bucket.reset_at + 0.1:
+                # New window
+                bucket.remaining = remaining
+                bucket.reset_at = reset_at
+            else:
+                # Same window, but we may have reserved slots for requests that haven't been sent yet
+                bucket.remaining = min(bucket.remaining, remaining)
+
+        if status == 429:
+            self.ratelimited += 1
+            bucket.remaining = 0
+            bucket.reset_at = max(bucket.reset_at, reset_at)
+
+    @staticmethod
+    def retry_delay(status, headers):
+        """Returns how many seconds a 429 asked us to wait, or None if it's not a 429 or didn't say (e.g. one
+        sent by a proxy)."""
+        if status != 429:
+            return None
+        try:
+            if 'X-RateLimit-Reset-After' in headers:
+                return int(headers['X-RateLimit-Reset-After']) / 1000
+            elif 'Retry-After' in headers:
+                return float(headers['Retry-After'])
+        except ValueError:
+            pass
+        return None
+
+    def trace_config(self):
+        """Returns an aiohttp trace config that routes every request through the rate limiter."""
+        config = aiohttp.TraceConfig()
+
+        async def on_request_start(_session, context, params):
+            context.route = self.route(params.method, params.url)
+            await self.acquire(context.route)
+
+        async def on_request_end(_session, context, params):
+            self.update(context.route, params.response.status, params.response.headers)
+            retry_after.set(self.retry_delay(params.response.status, params.response.headers))
+
+        config.on_request_start.append(on_request_start)
+        config.on_request_end.append(on_request_end)
+        return config
+
+    def metrics(self):
+        return {
+            'routes': len(self._routes),
+            'buckets': len(self._buckets),
+            'requests': self.requests,
+            'delayed': self.delayed,
+            'ratelimited': self.ratelimited
+        }
+
 class Revolt(commands.Cog,name='Revolt Support'):
     """An extension that enables Unifier to run on Revolt. Manages the Revolt instance, as well as Revolt-to-Revolt and Revolt-to-external bridging.
 
@@ -210,11 +923,16 @@ class Revolt(commands.Cog,name='Revolt Support'):
         if not 'revolt' in self.bot.config.get('external', ['revolt']):
             # revolt is intentionally lowercase
             raise RuntimeError('revolt is not listed as an external service in configuration. More info: https://wiki.unifierhq.org/setup-selfhosted/getting-started/unifier-older-versions#installing-revolt-support')
+        self.logger = log.buildlogger(self.bot.package, 'revolt.core', self.bot.loglevel)
+        self.persistence = DatabaseWriter(
+            self.bot, self.logger,
+            interval=self.bot.config.get('revolt_save_interval', 5),
+            journal_path=self.bot.config.get('revolt_journal_path', 'revolt_journal.jsonl')
+        )
         if not hasattr(self.bot, 'revolt_client'):
             self.bot.revolt_client = None
             self.bot.revolt_session = None
             self.bot.revolt_client_task = asyncio.create_task(self.revolt_boot())
-        self.logger = log.buildlogger(self.bot.package, 'revolt.core', self.bot.loglevel)
         restrictions_legacy.attach_bot(self.bot)
 
     def db(self):
@@ -226,6 +944,19 @@ class Revolt(commands.Cog,name='Revolt Support'):
             self.bot = None
             self.logger = None
             self.compatibility_mode = False
+            self.room_index = None
+            self.ban_index = None
+            self.persistence = None
+            self.permission_cache = PermissionCache()
+            self.identity_cache = IdentityCache()
+            self.singleflight = SingleFlight()
+            self.emoji_cache = EmojiCache()
+            self.ratelimiter = None
+            self.spool = None
+            self.idempotency_key = idempotency_key
+            self.pacing = pacing
+            self.fanout_parent = fanout_parent
+            self.retry_after = retry_after
 
         def dispatch(self, event: str, *args: Any) -> None:
             """Dispatch an event, this is typically used for testing and internals.
@@ -265,17 +996,48 @@ class Revolt(commands.Cog,name='Revolt Support'):
         def add_bot(self,bot):
             """Adds a Discord bot to the Revolt client."""
             self.bot = bot
+            self.ban_index = BanIndex(bot)
+            self.reactions = ReactionAggregator(
+                self.forward_reactions, window=bot.config.get('revolt_reaction_window', 300) / 1000
+            )
 
         def add_logger(self,logger):
             self.logger = logger
 
+        def add_persistence(self, persistence):
+            """Adds the database writer owned by the Revolt Support cog."""
+            self.persistence = persistence
+            self.ban_index.persistence = persistence
+
         async def get_prefix(self, message: revolt.Message):
             return self.bot.command_prefix
 
+        def get_room(self, message):
+            """Returns the room the message's channel is bound to, if any."""
+            try:
+                server_id = message.server.id
+            except LookupError:
+                return None
+            if not self.room_index:
+                self.room_index = RoomIndex(self.bot, compatibility_mode=self.compatibility_mode)
+                self.room_index.rebuild()
+            return self.room_index.get(server_id, message.channel.id)
+
         async def on_ready(self):
             self.logger.info('Revolt client booted!')
             if not hasattr(self.bot, 'platforms_former'):
                 self.compatibility_mode = True
+            self.room_index = RoomIndex(self.bot, compatibility_mode=self.compatibility_mode)
+            self.room_index.rebuild()
+            self.ban_index.start()
+            # Emojis from the Ready payload. revolt.py doesn't dispatch emoji events, so emojis created later are
+            # fetched and cached the first time someone reacts with them.
+            for emoji in self.state.global_emojis:
+                self.emoji_cache.put(emoji.id, emoji.name)
+            for server in self.state.servers.values():
+                for emoji in server.emojis:
+                    self.emoji_cache.put(emoji.id, emoji.name)
+            if self.compatibility_mode:
                 return
             if 'revolt' in self.bot.platforms.keys():
                 self.bot.platforms['revolt'].attach_bot(self)
@@ -287,78 +1049,193 @@ class Revolt(commands.Cog,name='Revolt Support'):
                     {'revolt':self.bot.platforms_former['revolt'].RevoltPlatform(self,self.bot)}
                 )
 
-        async def on_raw_reaction_add(self, event):
-            try:
-                msg = await self.bot.bridge.fetch_message(event['id'])
-            except:
-                return
+            if self.bot.config.get('revolt_spool', False) and not self.spool:
+                self.spool = self.bot.platforms_former['revolt'].SendSpool(
+                    path=self.bot.config.get('revolt_spool_path', 'revolt_spool'),
+                    deadline=self.bot.config.get('revolt_spool_deadline', 600)
+                )
+                entries, segments = await self.bot.loop.run_in_executor(None, self.spool.load)
+                asyncio.create_task(self.replay_spool(entries, segments))
 
-            if event['user_id'] in self.bot.db['fullbanned']:
+        async def replay_spool(self, entries, segments):
+            """Replays sends, edits and deletes that weren't completed before the last shutdown."""
+            replayed = 0
+            for entry in sorted(entries, key=lambda x: x['ts']):
+                try:
+                    await self.bot.platforms['revolt'].replay(entry)
+                    replayed += 1
+                except:
+                    self.logger.exception(f'Could not replay spooled {entry["op"]}')
+
+            # Replayed entries have been recorded again, so the old segments can go
+            await self.bot.loop.run_in_executor(None, self.spool.discard, segments)
+            if entries:
+                self.logger.info(f'Replayed {replayed} of {len(entries)} spooled operations')
+
+        async def own_permissions(self, server, channel=None):
+            """Returns the bot's own permissions in a server or channel."""
+            permissions = self.permission_cache.get(server.id, channel.id if channel else None, self.user.id)
+            if permissions is None:
+                try:
+                    me = server.get_member(self.user.id)
+                except:
+                    me = await self.singleflight.run(
+                        ('member', server.id, self.user.id), lambda: server.fetch_member(self.user.id)
+                    )
+                permissions = self.permission_cache.permissions(me, channel)
+            return permissions
+
+        def get_webhook(self, channel_id):
+            """Returns the cached webhook for a channel, if webhook sends are enabled."""
+            if not self.bot.config.get('revolt_webhook_sends', False):
+                return None
+            return self.bot.db.get('revolt_webhooks', {}).get(channel_id)
+
+        async def create_webhook(self, channel):
+            """Creates and caches a webhook for a bound channel, so copies get their own rate limit buckets."""
+            if not self.bot.config.get('revolt_webhook_sends', False):
+                return None
+            webhook = await self.http.request('POST', f'/channels/{channel.id}/webhooks', json={'name': 'Unifier'})
+            data = {'id': webhook['id'], 'token': webhook['token']}
+            if not 'revolt_webhooks' in self.bot.db.keys():
+                self.bot.db.update({'revolt_webhooks': {}})
+                self.persistence.mark_dirty()
+            self.bot.db['revolt_webhooks'].update({channel.id: data})
+            self.persistence.record('set', ['revolt_webhooks', channel.id], data)
+            return data
+
+        async def remove_webhook(self, channel_id, revoke=True):
+            """Forgets a channel's webhook, deleting it from Revolt too if revoke is set."""
+            webhook = self.bot.db.get('revolt_webhooks', {}).pop(channel_id, None)
+            if not webhook:
                 return
+            self.persistence.record('delete', ['revolt_webhooks', channel_id])
+            if revoke:
+                try:
+                    await self.http.request('DELETE', f'/webhooks/{webhook["id"]}/{webhook["token"]}')
+                except:
+                    pass
+
+        def is_own_message(self, message):
+            """Returns whether a message was sent by the bot, either directly or through one of its webhooks."""
+            if message.author.id == self.user.id:
+                return True
+            webhook = self.bot.db.get('revolt_webhooks', {}).get(message.channel.id)
+            return bool(webhook) and message.author.id == webhook['id']
+
+        async def on_server_update(self, *args):
+            # Default permissions may have changed
+            try:
+                self.permission_cache.invalidate_server(args[-1].id)
+                self.identity_cache.invalidate('server', args[-1].id)
+            except AttributeError:
+                self.permission_cache.clear()
+
+        async def on_server_delete(self, server):
+            self.permission_cache.invalidate_server(server.id)
+            self.identity_cache.invalidate('server', server.id)
+
+        async def on_role_create(self, role):
+            try:
+                self.permission_cache.invalidate_server(role.server.id)
+            except AttributeError:
+                self.permission_cache.clear()
+
+        async def on_role_update(self, *args):
+            # Role changes can affect every channel in the server
+            try:
+                self.permission_cache.invalidate_server(args[-1].server.id)
+            except AttributeError:
+                self.permission_cache.clear()
 
-            emoji = event['emoji_id']
-            if pymoji.is_emoji(emoji):
+        async def on_role_delete(self, role):
+            try:
+                self.permission_cache.invalidate_server(role.server.id)
+            except AttributeError:
+                self.permission_cache.clear()
+
+        async def on_channel_update(self, *args):
+            try:
+                self.identity_cache.invalidate('channel', args[-1].id)
+            except AttributeError:
                 pass
-            else:
-                emoji = await self.fetch_emoji(event['emoji_id'])
-                emoji = f'<r:{emoji.name}:{emoji.id}>'
+            try:
+                self.permission_cache.invalidate_channel(args[-1].server.id, args[-1].id)
+            except LookupError:
+                # Not a server channel
+                pass
+            except AttributeError:
+                self.permission_cache.clear()
 
-            await msg.add_reaction(emoji, event['user_id'], platform='revolt')
+        async def on_channel_delete(self, channel):
+            self.identity_cache.invalidate('channel', channel.id)
+            try:
+                self.permission_cache.invalidate_channel(channel.server.id, channel.id)
+            except (AttributeError, LookupError):
+                pass
 
-        async def on_raw_reaction_remove(self, event):
+        async def on_member_update(self, *args):
             try:
-                msg = await self.bot.bridge.fetch_message(event['id'])
+                self.permission_cache.invalidate_member(args[-1].server.id, args[-1].id)
+            except AttributeError:
+                self.permission_cache.clear()
+
+        async def on_member_leave(self, member):
+            self.permission_cache.invalidate_member(member.server.id, member.id)
+
+        async def reaction_emoji(self, emoji_id):
+            """Returns a reaction's emoji in the form the bridge expects."""
+            if is_unicode_emoji(emoji_id):
+                return emoji_id
+
+            name = self.emoji_cache.get(emoji_id)
+            if not name:
+                emoji = await self.singleflight.run(('emoji', emoji_id), lambda: self.fetch_emoji(emoji_id))
+                name = emoji.name
+                self.emoji_cache.put(emoji_id, name)
+            return f'<r:{name}:{emoji_id}>'
+
+        async def forward_reactions(self, message_id, reactions):
+            """Bridges a batch of (emoji_id, user_id, added) reactions on a message."""
+            try:
+                msg = await self.bot.bridge.fetch_message(message_id)
             except:
                 return
 
+            for emoji_id, user_id, added in reactions:
+                try:
+                    emoji = await self.reaction_emoji(emoji_id)
+                    if added:
+                        await msg.add_reaction(emoji, user_id, platform='revolt')
+                    else:
+                        await msg.remove_reaction(emoji, user_id)
+                except:
+                    self.logger.exception(f'Could not bridge reaction on message {message_id}')
+
+        async def on_raw_reaction_add(self, event):
             if event['user_id'] in self.bot.db['fullbanned']:
                 return
+            self.reactions.add(event['id'], event['emoji_id'], event['user_id'], True)
 
-            emoji = event['emoji_id']
-            if pymoji.is_emoji(emoji):
-                pass
-            else:
-                emoji = await self.fetch_emoji(event['emoji_id'])
-                emoji = f'<r:{emoji.name}:{emoji.id}>'
-
-            await msg.remove_reaction(emoji, event['user_id'])
+        async def on_raw_reaction_remove(self, event):
+            if event['user_id'] in self.bot.db['fullbanned']:
+                return
+            self.reactions.add(event['id'], event['emoji_id'], event['user_id'], False)
 
         async def on_message(self, message):
-            roomname = None
-            if self.compatibility_mode:
-                roomkey = 'rooms_revolt'
-            else:
-                roomkey = 'rooms'
-            for key in self.bot.db[roomkey]:
-                try:
-                    if self.compatibility_mode:
-                        if message.channel.id in str(self.bot.db['rooms_revolt'][key][message.server.id]):
-                            roomname = key
-                            break
-                    else:
-                        if message.channel.id in str(self.bot.db['rooms'][key]['revolt'][message.server.id]):
-                            roomname = key
-                            break
-                except:
-                    pass
-            if message.author.id==self.user.id:
+            roomname = self.get_room(message)
+            if not roomname and not message.content.startswith(self.bot.command_prefix):
+                # Unbridged channel and not a command, nothing to do here
+                return
+            if self.is_own_message(message):
+                return
+            if self.ban_index.is_banned(message.author.id):
                 return
-            t = time.time()
-            if message.author.id in f'{self.bot.db["banned"]}':
-                if t >= self.bot.db["banned"][message.author.id]:
-                    self.bot.db["banned"].pop(message.author.id)
-                    self.bot.db.save_data()
-                else:
-                    return
 
             is_dm = False
             try:
-                if message.server.id in f'{self.bot.db["banned"]}':
-                    if t >= self.bot.db["banned"][message.server.id]:
-                        self.bot.db["banned"].pop(message.server.id)
-                        self.bot.db.save_data()
-                    else:
-                        return
+                if self.ban_index.is_banned(message.server.id):
+                    return
             except LookupError:
                 is_dm = True
             if message.content==f'{self.bot.command_prefix}agree':
@@ -375,7 +1252,7 @@ class Revolt(commands.Cog,name='Revolt Support'):
                 emojified = True
                 should_delete = True
 
-            if not message.server.get_member(self.user.id).get_channel_permissions(message.channel).manage_messages:
+            if not (await self.own_permissions(message.server, message.channel)).manage_messages:
                 if emojified:
                     return await message.channel.send(
                         'Parent message could not be deleted. I may be missing the `Manage Messages` permission.'
@@ -389,6 +1266,7 @@ class Revolt(commands.Cog,name='Revolt Support'):
 
             tasks = []
             parent_id = None
+            fanout_token = None
             multisend = True
 
             if message.content.startswith('['):
@@ -406,7 +1284,7 @@ class Revolt(commands.Cog,name='Revolt Support'):
                 # Multisend
                 # Sends Revolt message along with other platforms to minimize
                 # latency on external platforms.
-                self.bot.bridge.bridged.append(self.bot.bridge.UnifierMessage(
+                parent = self.bot.bridge.UnifierMessage(
                     author_id=message.author.id,
                     guild_id=message.server.id,
                     channel_id=message.channel.id,
@@ -418,7 +1296,11 @@ class Revolt(commands.Cog,name='Revolt Support'):
                     room=roomname,
                     external_urls={},
                     external_bridged=False
-                ))
+                )
+                self.bot.bridge.bridged.append(parent)
+
+                # Tasks created from here on inherit this, so Revolt copies are registered as they're delivered
+                fanout_token = self.fanout_parent.set(parent)
                 if datetime.datetime.now().day != self.bot.bridge.msg_stats_reset:
                     self.bot.bridge.msg_stats_reset = datetime.datetime.now().day
                     self.bot.bridge.msg_stats = {}
@@ -520,45 +1402,25 @@ class Revolt(commands.Cog,name='Revolt Support'):
                         experiments.append(experiment)
                 self.logger.info(f'Experiments: {experiments}')
                 pass
+            finally:
+                if fanout_token:
+                    self.fanout_parent.reset(fanout_token)
+
+            if message.attachments and not self.compatibility_mode and 'revolt' in self.bot.platforms.keys():
+                # Every platform has its copy, so the downloaded attachments don't need to be shared anymore
+                self.bot.platforms['revolt'].assets.discard([attachment.id for attachment in message.attachments])
 
             if should_delete:
                 await message.delete()
 
         async def on_message_update(self, before, message):
-            if message.author.id==self.user.id:
+            if self.is_own_message(message):
                 return
-            roomname = None
-            if self.compatibility_mode:
-                roomkey = 'rooms_revolt'
-            else:
-                roomkey = 'rooms'
-            for key in self.bot.db[roomkey]:
-                try:
-                    if self.compatibility_mode:
-                        if message.channel.id in str(self.bot.db['rooms_revolt'][key][message.server.id]):
-                            roomname = key
-                            break
-                    else:
-                        if message.channel.id in str(self.bot.db['rooms'][key]['revolt'][message.server.id]):
-                            roomname = key
-                            break
-                except:
-                    pass
+            roomname = self.get_room(message)
             if not roomname:
                 return
-            t = time.time()
-            if message.author.id in f'{self.bot.db["banned"]}':
-                if t >= self.bot.db["banned"][message.author.id]:
-                    self.bot.db["banned"].pop(message.author.id)
-                    self.bot.db.save_data()
-                else:
-                    return
-            if message.server.id in f'{self.bot.db["banned"]}':
-                if t >= self.bot.db["banned"][message.server.id]:
-                    self.bot.db["banned"].pop(message.server.id)
-                    self.bot.db.save_data()
-                else:
-                    return
+            if self.ban_index.is_banned(message.author.id) or self.ban_index.is_banned(message.server.id):
+                return
 
             msgdata = await self.bot.bridge.fetch_message(message.id)
 
@@ -568,40 +1430,13 @@ class Revolt(commands.Cog,name='Revolt Support'):
                 await self.bot.bridge.edit(msgdata.id, message.content, source='revolt')
 
         async def on_message_delete(self, message):
-            roomname = None
-            if self.compatibility_mode:
-                roomkey = 'rooms_revolt'
-            else:
-                roomkey = 'rooms'
-            for key in self.bot.db[roomkey]:
-                try:
-                    if self.compatibility_mode:
-                        if message.channel.id in str(self.bot.db['rooms_revolt'][key][message.server.id]):
-                            roomname = key
-                            break
-                    else:
-                        if message.channel.id in str(self.bot.db['rooms'][key]['revolt'][message.server.id]):
-                            roomname = key
-                            break
-                except:
-                    continue
+            roomname = self.get_room(message)
             if not roomname:
                 return
-            if message.author.id == self.user.id:
+            if self.is_own_message(message):
+                return
+            if self.ban_index.is_banned(message.author.id) or self.ban_index.is_banned(message.server.id):
                 return
-            t = time.time()
-            if message.author.id in f'{self.bot.db["banned"]}':
-                if t >= self.bot.db["banned"][message.author.id]:
-                    self.bot.db["banned"].pop(message.author.id)
-                    self.bot.db.save_data()
-                else:
-                    return
-            if message.server.id in f'{self.bot.db["banned"]}':
-                if t >= self.bot.db["banned"][message.server.id]:
-                    self.bot.db["banned"].pop(message.server.id)
-                    self.bot.db.save_data()
-                else:
-                    return
             try:
                 msgdata = await self.bot.bridge.fetch_message(message.id)
                 if not msgdata.id==message.id:
@@ -697,9 +1532,10 @@ class Revolt(commands.Cog,name='Revolt Support'):
                 self.bot.db['rooms'].update({room: {}})
                 self.bot.db['rooms_revolt'].update({room: {}})
                 self.bot.db['rules'].update({room: []})
-                self.bot.db.save_data()
+                self.persistence.mark_dirty()
             else:
                 self.bot.bridge.create_room(room, private=private or force_private, origin=ctx.server.id)
+            self.room_index.sync(room)
             if msg:
                 await msg.edit(content=f'Created room `{room}`!')
             else:
@@ -726,7 +1562,7 @@ class Revolt(commands.Cog,name='Revolt Support'):
                 self.bot.db['rules'][room].append(rule)
             else:
                 self.bot.db['rooms'][room]['meta']['rules'].append(rule)
-            await self.bot.loop.run_in_executor(None, lambda: self.bot.db.save_data())
+            self.persistence.mark_dirty()
             await ctx.send('Added rule!')
 
         @rv_commands.command(name='delete-rule', aliases=['delrule'])
@@ -750,7 +1586,7 @@ class Revolt(commands.Cog,name='Revolt Support'):
                 self.bot.db['rules'][room].pop(rule - 1)
             else:
                 self.bot.db['rooms'][room]['meta']['rules'].pop(rule - 1)
-            await self.bot.loop.run_in_executor(None, lambda: self.bot.db.save_data())
+            self.persistence.mark_dirty()
             await ctx.send('Removed rule!')
 
         @rv_commands.command()
@@ -771,14 +1607,14 @@ class Revolt(commands.Cog,name='Revolt Support'):
                     self.bot.db['restricted'].remove(room)
                 else:
                     self.bot.db['rooms'][room]['meta']['restricted'] = False
-                await self.bot.loop.run_in_executor(None, lambda: self.bot.db.save_data())
+                self.persistence.mark_dirty()
                 await ctx.send(f'Unrestricted `{room}`!')
             else:
                 if self.compatibility_mode:
                     self.bot.db['restricted'].append(room)
                 else:
                     self.bot.db['rooms'][room]['meta']['restricted'] = True
-                await self.bot.loop.run_in_executor(None, lambda: self.bot.db.save_data())
+                self.persistence.mark_dirty()
                 await ctx.send(f' Restricted `{room}`!')
 
         @rv_commands.command()
@@ -806,7 +1642,7 @@ class Revolt(commands.Cog,name='Revolt Support'):
                 else:
                     self.bot.db['rooms'][room]['meta']['locked'] = True
                 await ctx.send(f'Locked `{room}`!')
-            await self.bot.loop.run_in_executor(None, lambda: self.bot.db.save_data())
+            self.persistence.mark_dirty()
 
         @rv_commands.command()
         async def rename(self, ctx, room, newroom):
@@ -838,7 +1674,8 @@ class Revolt(commands.Cog,name='Revolt Support'):
                 if room in self.bot.db['rooms_revolt'].keys():
                     self.bot.db['rooms_revolt'].update({newroom: self.bot.db['rooms_revolt'][room]})
                     self.bot.db['rooms_revolt'].pop(room)
-            await self.bot.loop.run_in_executor(None, lambda: self.bot.db.save_data())
+            self.room_index.rename(room, newroom)
+            self.persistence.mark_dirty()
             await ctx.send('Room renamed!')
 
         @bridge.command(aliases=['connect','link'])
@@ -950,7 +1787,7 @@ class Revolt(commands.Cog,name='Revolt Support'):
                     return await ctx.send('Cancelled.')
                 if self.compatibility_mode:
                     self.bot.db['rooms_revolt'][room].update({f'{ctx.server.id}': [ctx.channel.id]})
-                    self.bot.db.save_data()
+                    self.persistence.mark_dirty()
                 else:
                     if invite:
                         await self.bot.bridge.accept_invite(ctx.author, invite_link, platform='revolt')
@@ -959,6 +1796,12 @@ class Revolt(commands.Cog,name='Revolt Support'):
                         await self.bot.bridge.join_room(ctx.author, room, ctx.channel, platform='revolt')
                     except self.bot.bridge.TooManyConnections:
                         return await ctx.send('Your server has reached the maximum number of allocated connections.')
+                self.room_index.sync(room)
+                try:
+                    await self.create_webhook(ctx.channel)
+                except:
+                    # Copies will be sent with masquerades instead
+                    self.logger.exception(f'Could not create webhook for channel {ctx.channel.id}')
                 await ctx.send('Linked channel with network!')
                 try:
                     await msg.pin()
@@ -983,11 +1826,14 @@ class Revolt(commands.Cog,name='Revolt Support'):
             if not room in self.bot.db['rooms'].keys():
                 return await ctx.send('This isn\'t a valid room.')
             try:
+                if self.room_index.get(ctx.server.id, ctx.channel.id) == room:
+                    await self.remove_webhook(ctx.channel.id)
                 if self.compatibility_mode:
                     self.bot.db['rooms_revolt'][room].pop(f'{ctx.server.id}')
-                    self.bot.db.save_data()
+                    self.persistence.mark_dirty()
                 else:
                     await self.bot.bridge.leave_room(ctx.server, room, platform='revolt')
+                self.room_index.sync(room)
                 await ctx.send('Unlinked channel from network!')
             except:
                 await ctx.send('Something went wrong - check my permissions.')
@@ -1026,6 +1872,7 @@ class Revolt(commands.Cog,name='Revolt Support'):
                 return await ctx.send('Aborted.')
 
             self.bot.bridge.delete_room(room)
+            self.room_index.drop(room)
             await ctx.send('Room disbanded.')
 
         @bridge.command()
@@ -1049,12 +1896,13 @@ class Revolt(commands.Cog,name='Revolt Support'):
                 if not f'{ctx.author.id}' in list(self.bot.db['avatars'].keys()):
                     return await ctx.send('You don\'t have a custom avatar!')
                 self.bot.db['avatars'].pop(f'{ctx.author.id}')
+                self.persistence.record('delete', ['avatars', f'{ctx.author.id}'])
                 return await ctx.send('Custom avatar removed!')
             if not url == '':
                 embed.title = 'This is how you\'ll look!'
                 embed.description = 'Your avatar has been saved!'
                 self.bot.db['avatars'].update({f'{ctx.author.id}': url})
-                self.bot.db.save_data()
+                self.persistence.record('set', ['avatars', f'{ctx.author.id}'], url)
             try:
                 await ctx.send(embed=embed)
             except:
@@ -1151,7 +1999,7 @@ class Revolt(commands.Cog,name='Revolt Support'):
                 await ctx.send(embeds=[embed])
             elif color == 'inherit':
                 self.bot.db['colors'].update({f'{ctx.author.id}': 'inherit'})
-                self.bot.db.save_data()
+                self.persistence.record('set', ['colors', f'{ctx.author.id}'], 'inherit')
                 await ctx.send('Supported platforms will now inherit your Revolt role color.')
             else:
                 try:
@@ -1159,7 +2007,7 @@ class Revolt(commands.Cog,name='Revolt Support'):
                 except:
                     return await ctx.send('Invalid hex code!')
                 self.bot.db['colors'].update({f'{ctx.author.id}': color})
-                self.bot.db.save_data()
+                self.persistence.record('set', ['colors', f'{ctx.author.id}'], color)
                 await ctx.send('Supported platforms will now inherit the custom color.')
 
         @bridge.command()
@@ -1170,9 +2018,10 @@ class Revolt(commands.Cog,name='Revolt Support'):
                 return await ctx.send('Please keep your nickname within 30 characters.')
             if len(nickname) == 0:
                 self.bot.db['nicknames'].pop(f'{ctx.author.id}', None)
+                self.persistence.record('delete', ['nicknames', f'{ctx.author.id}'])
             else:
                 self.bot.db['nicknames'].update({f'{ctx.author.id}': nickname})
-            self.bot.db.save_data()
+                self.persistence.record('set', ['nicknames', f'{ctx.author.id}'], nickname)
             await ctx.send('Nickname updated.')
 
         @bridge.command()
@@ -1217,11 +2066,11 @@ class Revolt(commands.Cog,name='Revolt Support'):
             )
 
             if not paused:
-                self.bot.db['paused'].append(f'{ctx.user.id}')
-                self.bot.db.save_data()
+                self.bot.db['paused'].append(f'{ctx.author.id}')
+                self.persistence.record('add', ['paused'], f'{ctx.author.id}')
             else:
-                self.bot.db['paused'].remove(f'{ctx.user.id}')
-                self.bot.db.save_data()
+                self.bot.db['paused'].remove(f'{ctx.author.id}')
+                self.persistence.record('remove', ['paused'], f'{ctx.author.id}')
                 embed.title = ':white_check_mark: Bridging resumed'
                 embed.description = 'Your messages will now be bridged again.'
 
@@ -1347,23 +2196,7 @@ class Revolt(commands.Cog,name='Revolt Support'):
         @moderation.command()
         async def delete(self, ctx, *, msg_id=None):
             """Deletes all bridged messages. Does not delete the original."""
-            gbans = self.bot.db['banned']
-            ct = time.time()
-            if f'{ctx.author.id}' in list(gbans.keys()):
-                banuntil = gbans[f'{ctx.author.id}']
-                if ct >= banuntil and not banuntil == 0:
-                    self.bot.db['banned'].pop(f'{ctx.author.id}')
-                    self.bot.db.update()
-                else:
-                    return
-            if f'{ctx.server.id}' in list(gbans.keys()):
-                banuntil = gbans[f'{ctx.server.id}']
-                if ct >= banuntil and not banuntil == 0:
-                    self.bot.db['banned'].pop(f'{ctx.server.id}')
-                    self.bot.db.update()
-                else:
-                    return
-            if f'{ctx.author.id}' in list(gbans.keys()) or f'{ctx.server.id}' in list(gbans.keys()):
+            if self.ban_index.is_banned(ctx.author.id) or self.ban_index.is_banned(ctx.server.id):
                 return await ctx.send('Your account or your guild is currently **global restricted**.')
 
             try:
@@ -1421,7 +2254,7 @@ class Revolt(commands.Cog,name='Revolt Support'):
             if userid in banlist:
                 return await ctx.send('User/server already banned!')
             self.bot.db['blocked'][f'{ctx.guild.id}'].append(userid)
-            self.bot.db.save_data()
+            self.persistence.record('set', ['blocked', f'{ctx.guild.id}'], self.bot.db['blocked'][f'{ctx.guild.id}'])
             await ctx.send('User/server can no longer forward messages to this channel!')
 
         @moderation.command(aliases=['unban'])
@@ -1442,7 +2275,7 @@ class Revolt(commands.Cog,name='Revolt Support'):
             if not userid in banlist:
                 return await ctx.send('User/server not banned!')
             self.bot.db['blocked'][f'{ctx.guild.id}'].remove(userid)
-            self.bot.db.save_data()
+            self.persistence.record('set', ['blocked', f'{ctx.guild.id}'], self.bot.db['blocked'][f'{ctx.guild.id}'])
             await ctx.send('User/server can now forward messages to this channel!')
 
         @moderation.command(name='under-attack')
@@ -1756,7 +2589,7 @@ class Revolt(commands.Cog,name='Revolt Support'):
             if userid in self.bot.admins or user.bot:
                 return await ctx.send('are you fr')
             self.bot.db['moderators'].append(userid)
-            await self.bot.loop.run_in_executor(None, lambda: self.bot.db.save_data())
+            self.persistence.mark_dirty()
             await ctx.send(f'**{user.name}#{user.discriminator}** is now a moderator!')
 
         @config.command(aliases=['remmod', 'delmod', 'removemod'])
@@ -1774,7 +2607,7 @@ class Revolt(commands.Cog,name='Revolt Support'):
             if userid in self.bot.admins or user.bot:
                 return await ctx.send('are you fr')
             self.bot.db['moderators'].remove(userid)
-            await self.bot.loop.run_in_executor(None, lambda: self.bot.db.save_data())
+            self.persistence.mark_dirty()
             await ctx.send(f'**{user.name}#{user.discriminator}** is no longer a moderator!')
 
         @rv_commands.command()
@@ -2063,6 +2896,12 @@ class Revolt(commands.Cog,name='Revolt Support'):
 
     async def revolt_boot(self):
         if self.bot.revolt_client is None:
+            applied = await self.persistence.replay()
+            if applied > 0:
+                self.logger.info(f'Replayed {applied} journaled database changes')
+
+            # Fold the journal into a snapshot, so it's never replayed over newer changes again
+            await self.persistence.flush(snapshot=True)
             if not hasattr(self.bot, 'platforms_former'):
                 self.logger.warning('Revolt Support is starting in legacy mode (non-NUPS).')
                 self.logger.info('Syncing Revolt rooms...')
@@ -2070,9 +2909,12 @@ class Revolt(commands.Cog,name='Revolt Support'):
                     if not key in list(self.bot.db['rooms_revolt'].keys()):
                         self.bot.db['rooms_revolt'].update({key: {}})
                         self.logger.debug('Synced room '+key)
-                self.bot.db.save_data()
+                self.persistence.mark_dirty()
             while True:
-                async with aiohttp.ClientSession() as session:
+                ratelimiter = RateLimiter()
+                async with aiohttp.ClientSession(
+                        trace_configs=[ratelimiter.trace_config(), idempotency_trace_config()]
+                ) as session:
                     self.bot.revolt_session = session
 
                     if cog_tokenstore:
@@ -2088,6 +2930,8 @@ class Revolt(commands.Cog,name='Revolt Support'):
                         self.bot.revolt_client = self.Client(session, os.environ.get('TOKEN_REVOLT'), help_command=None)
                     self.bot.revolt_client.add_bot(self.bot)
                     self.bot.revolt_client.add_logger(log.buildlogger(self.bot.package, 'revolt.client', self.bot.loglevel))
+                    self.bot.revolt_client.add_persistence(self.persistence)
+                    self.bot.revolt_client.ratelimiter = ratelimiter
                     self.logger.info('Booting Revolt client...')
                     try:
                         await self.bot.revolt_client.start()
@@ -2108,6 +2952,11 @@ class Revolt(commands.Cog,name='Revolt Support'):
     async def stop_revolt(self, ctx):
         """Kills the Revolt client. This is automatically done when upgrading Unifier."""
         try:
+            if self.bot.revolt_client and self.bot.revolt_client.ban_index:
+                self.bot.revolt_client.ban_index.stop()
+            await self.persistence.close()
+            if self.bot.revolt_client and self.bot.revolt_client.spool:
+                await self.bot.revolt_client.spool.flush()
             await self.bot.revolt_session.close()
             self.bot.revolt_client_task.cancel()
             del self.bot.revolt_client
@@ -2124,6 +2973,11 @@ class Revolt(commands.Cog,name='Revolt Support'):
     async def restart_revolt(self, ctx):
         """Restarts the Revolt client."""
         try:
+            if self.bot.revolt_client and self.bot.revolt_client.ban_index:
+                self.bot.revolt_client.ban_index.stop()
+            await self.persistence.close()
+            if self.bot.revolt_client and self.bot.revolt_client.spool:
+                await self.bot.revolt_client.spool.flush()
             await self.bot.revolt_session.close()
             self.bot.revolt_client_task.cancel()
             del self.bot.revolt_client
@@ -2135,6 +2989,141 @@ class Revolt(commands.Cog,name='Revolt Support'):
             self.logger.exception('Something went wrong!')
             await ctx.send('Something went wrong while restarting the instance.')
 
+    @commands.command(name='revolt-metrics')
+    @restrictions_legacy.owner()
+    async def revolt_metrics(self, ctx):
+        """Shows Revolt Support performance metrics."""
+        embed = nextcord.Embed(title='Revolt Support metrics', color=self.bot.colors.unifier)
+
+        persistence = self.persistence.metrics()
+        embed.add_field(
+            name='Database writes',
+            value=(
+                f'Pending mutations: {persistence["pending"]}\n'+
+                f'Mutations: {persistence["mutations"]} ({persistence["coalesced"]} coalesced)\n'+
+                f'Writes: {persistence["writes"]} ({persistence["snapshots"]} snapshots, {persistence["failures"]} failed)\n'+
+                f'Journal size: {persistence["journal_size"]} bytes\n'+
+                f'Latency: {round(persistence["last_latency"] * 1000)}ms last, '+
+                f'{round(persistence["avg_latency"] * 1000)}ms avg, {round(persistence["max_latency"] * 1000)}ms max'
+            ),
+            inline=False
+        )
+
+        if self.bot.revolt_client:
+            ratelimiter = self.bot.revolt_client.ratelimiter.metrics()
+            embed.add_field(
+                name='Rate limits',
+                value=(
+                    f'Known routes: {ratelimiter["routes"]} ({ratelimiter["buckets"]} buckets)\n'+
+                    f'Requests: {ratelimiter["requests"]} ({ratelimiter["delayed"]} delayed, '+
+                    f'{ratelimiter["ratelimited"]} rate limited)'
+                ),
+                inline=False
+            )
+
+            reactions = self.bot.revolt_client.reactions
+            embed.add_field(
+                name='Reactions',
+                value=f'Events: {reactions.events} ({reactions.forwarded} forwarded after batching)',
+                inline=False
+            )
+
+        platform = self.bot.platforms.get('revolt') if hasattr(self.bot, 'platforms') else None
+        if platform:
+            metrics = platform.metrics()
+            embed.add_field(
+                name='Outbound concurrency',
+                value=(
+                    f'Limit: {metrics["concurrency_limit"]}\n'+
+                    f'In flight: {metrics["concurrency_inflight"]}\n'+
+                    f'Queued: {metrics["concurrency_queued"]}\n'+
+                    f'Latency: {round(metrics["concurrency_latency"] * 1000)}ms avg'
+                ),
+                inline=False
+            )
+
+            embed.add_field(
+                name='Retries',
+                value=(
+                    f'Budget: {round(metrics["retry_tokens"], 1)} tokens\n'+
+                    ('\n'.join([f'{cause}: {count}' for cause, count in sorted(metrics['retries'].items())]) or
+                     'No retries yet')
+                ),
+                inline=False
+            )
+
+            embed.add_field(
+                name='Identity cache',
+                value=(
+                    f'Hits: {metrics["identity_hits"]}\n'+
+                    f'Known missing: {metrics["identity_negative_hits"]}\n'+
+                    f'Misses: {metrics["identity_misses"]}\n'+
+                    f'Duplicate fetches saved: {sum(metrics["singleflight_saved"].values())} '+
+                    f'({metrics["singleflight_calls"]} fetches made)'
+                ),
+                inline=False
+            )
+
+            embed.add_field(
+                name='Attachments',
+                value=(
+                    f'Uploads: {metrics["attachment_uploads"]}\n'+
+                    f'Reused uploads: {metrics["attachment_reuses"]}\n'+
+                    f'Cached: {round(metrics["attachment_cache_size"] / 1048576, 1)} MB\n'+
+                    f'Revolt assets downloaded: {metrics["asset_downloads"]} ({metrics["asset_shares"]} shared)'
+                ),
+                inline=False
+            )
+
+            lagging = sorted(
+                [(server_id, lane) for server_id, lane in metrics['lanes'].items() if lane['depth'] > 0],
+                key=lambda x: x[1]['age'], reverse=True
+            )
+            embed.add_field(
+                name='Send lanes',
+                value=(
+                    f'Active lanes: {len(metrics["lanes"])} ({len(lagging)} with a backlog)\n'+
+                    '\n'.join([
+                        f'`{server_id}`: {lane["depth"]} queued, oldest {round(lane["age"], 1)}s, '+
+                        f'{lane["rejected"]} rejected'
+                        for server_id, lane in lagging[:5]
+                    ])
+                ),
+                inline=False
+            )
+
+        await ctx.send(embed=embed)
+
+    @commands.command(name='revolt-circuits')
+    @restrictions_legacy.owner()
+    async def revolt_circuits(self, ctx):
+        """Shows Revolt destinations that are being skipped due to repeated errors."""
+        platform = self.bot.platforms.get('revolt') if hasattr(self.bot, 'platforms') else None
+        if not platform:
+            return await ctx.send('Revolt Support is not running as a bridge platform.')
+
+        tripped = [
+            (kind, target_id, circuit) for (kind, target_id), circuit in platform.circuits.items()
+            if not circuit.state == circuit.closed
+        ]
+        embed = nextcord.Embed(
+            title='Revolt circuits',
+            description=f'{len(tripped)} of {len(platform.circuits)} circuits are open or half-open.',
+            color=self.bot.colors.unifier
+        )
+        for kind, target_id, circuit in tripped[:25]:
+            retry_in = max(0, round(circuit.retry_at - time.monotonic()))
+            embed.add_field(
+                name=f'{kind.capitalize()} {target_id}',
+                value=(
+                    f'State: {circuit.state}\n'+
+                    f'Failures: {circuit.failures}\n'+
+                    f'Next probe: {retry_in}s\n'+
+                    f'Last error: `{type(circuit.last_error).__name__}`'
+                )
+            )
+        await ctx.send(embed=embed)
+
     @commands.command(name='fix-revolt')
     @restrictions_legacy.owner()
     async def fix_revolt(self, ctx):
@@ -22,8 +22,27 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 from utils import platform_base
 import revolt
 import nextcord
-from io import BytesIO
-from typing import Union, Optional
+import aiohttp
+import asyncio
+import collections
+import random
+import time
+import os
+import json
+import uuid
+import hashlib
+import tempfile
+import contextlib
+import mmap
+import weakref
+import re
+from io import RawIOBase
+from typing import Union
+
+try:
+    import ujson as json  # pylint: disable=import-error
+except:
+    pass
 
 class EmbedField:
     def __init__(self, name, value):
@@ -84,34 +103,973 @@ class Embed(revolt.SendableEmbed):
     def set_footer(self, text):
         self.footer = text
 
+class PreparedMessage:
+    def __init__(self, content, special, parent_id=None):
+        self.content = content
+        self.special = special
+        self.parent_id = parent_id or special.get('parent_id', None) or uuid.uuid4().hex
+        self.persona = None
+        self.embeds = special.get('embeds', None)
+        self.reply = special.get('reply', None)
+        self.files = special.get('files', None)
+
+    def files_for(self):
+        """Returns the attachments to send to every destination. Relayed files can be shared between destinations,
+        as reads are serialized, so files are only wrapped rather than copied."""
+        if not self.files:
+            return self.files
+        self.files = [
+            file if type(file) is RelayedFile else
+            RelayedFile(file.f, file.filename, spoiler=getattr(file, 'spoiler', False))
+            for file in self.files
+        ]
+        return self.files
+
+    def idempotency_key(self, channel):
+        """Returns a key that's the same for every attempt at sending this message to the channel."""
+        return hashlib.sha256(f'{self.parent_id}:{channel.id}'.encode('utf-8')).hexdigest()[:32]
+
+class CoalescedMessage:
+    """One part of a Revolt message that several bridged messages were merged into."""
+
+    def __init__(self, message, index):
+        self.message = message
+        self.index = index
+        self.id = f'{message.id}:{index}'
+
+    def __getattr__(self, name):
+        return getattr(self.message, name)
+
+class CoalesceBatch:
+    """Consecutive messages from the same author waiting to be sent to one channel as a single message."""
+
+    def __init__(self, key, prepared):
+        self.key = key
+        self.prepared = prepared
+        self.parts = []
+        self.future = asyncio.get_running_loop().create_future()
+        self.closed = False
+
+    @property
+    def length(self):
+        return sum(len(part) for part in self.parts) + len(self.parts)
+
+    def add(self, content):
+        self.parts.append(content)
+        return len(self.parts) - 1
+
+def release_later(loop, budget, size):
+    """Returns bytes to a budget from a finalizer, which may run on any thread."""
+    try:
+        loop.call_soon_threadsafe(budget.release, size)
+    except RuntimeError:
+        # The event loop has already been closed
+        pass
+
+class RelayedFile:
+    """An attachment on its way to Autumn. Large files are spilled to disk rather than held in memory."""
+
+    def __init__(self, fp, filename, size=None, spoiler=False, budget=None):
+        self.f = fp
+        self.filename = filename
+        self.spoiler = spoiler
+        self.digest = None
+        self.lock = asyncio.Lock()
+
+        if size is None:
+            fp.seek(0, os.SEEK_END)
+            size = fp.tell()
+            fp.seek(0)
+        self.size = size
+
+        # Bytes reserved in the budget when the file was downloaded, held until release() is called. If it never
+        # is, they're returned once the file is garbage collected.
+        self.budget = budget
+        self.reserved = budget is not None
+        self._release = weakref.finalize(
+            self, release_later, asyncio.get_running_loop(), budget, size
+        ) if budget else None
+
+    def release(self):
+        """Returns the file's bytes to the budget. Call it once every send of the file has finished."""
+        if self._release and self._release.detach():
+            self.budget.release(self.size)
+
+    async def chunks(self, chunk_size=262144):
+        """Yields the file's contents in chunks, reading from disk off the event loop."""
+        self.f.seek(0)
+        while True:
+            chunk = await asyncio.to_thread(self.f.read, chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    async def hash(self):
+        if not self.digest:
+            digest = hashlib.sha256()
+            async for chunk in self.chunks():
+                digest.update(chunk)
+            self.digest = digest.hexdigest()
+        return self.digest
+
+class SharedReader(RawIOBase):
+    """A read-only file object over a shared buffer. Every reader has its own position, and the bytes are never
+    copied into it."""
+
+    def __init__(self, buffer):
+        super().__init__()
+        self._buffer = buffer
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        size = max(0, min(len(b), len(self._buffer) - self._position))
+        b[:size] = self._buffer[self._position:self._position + size]
+        self._position += size
+        return size
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += len(self._buffer)
+        self._position = max(0, offset)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+class AssetStore:
+    """Downloads each Revolt attachment once and shares it between every platform it's being bridged to.
+
+    Large assets are kept in a memory-mapped temporary file rather than in memory. The store lets go of assets
+    once the fan-out they were downloaded for finishes, or when they haven't been handed out for ttl seconds.
+    They're freed once no reader uses them anymore."""
+
+    def __init__(self, ttl=60, mmap_threshold=8388608):
+        self.ttl = ttl
+        self.mmap_threshold = mmap_threshold
+        self._assets = {}
+        self._pending = {}
+
+        # Metrics
+        self.downloads = 0
+        self.shared = 0
+
+    async def reader(self, asset_id, size, download, download_to):
+        """Returns a reader for an asset. download returns the asset's bytes, download_to writes it to a file and
+        is used for assets above mmap_threshold."""
+        asset = self._assets.get(asset_id)
+        while not asset and asset_id in self._pending:
+            pending = self._pending[asset_id]
+            try:
+                asset = await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+                # The download we were waiting for was cancelled, so take it over unless another waiter already has
+
+        if asset:
+            self.shared += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self._pending.update({asset_id: future})
+            try:
+                asset = await self._download(size, download, download_to)
+            except Exception as e:
+                future.set_exception(e)
+                future.exception()
+                raise
+            except BaseException:
+                # Cancelled, so let the waiters download the asset themselves
+                future.cancel()
+                raise
+            finally:
+                self._pending.pop(asset_id, None)
+            self._assets.update({asset_id: asset})
+            future.set_result(asset)
+            self.downloads += 1
+
+        asset['expires'] = time.monotonic() + self.ttl
+        asyncio.get_running_loop().call_later(self.ttl, self.sweep)
+        return SharedReader(asset['buffer'])
+
+    async def _download(self, size, download, download_to):
+        if not size or size < self.mmap_threshold:
+            data = await download()
+            return {'buffer': memoryview(data), 'backing': None, 'expires': 0}
+
+        backing = tempfile.TemporaryFile()
+        try:
+            await download_to(backing)
+            backing.flush()
+            mapped = mmap.mmap(backing.fileno(), 0, access=mmap.ACCESS_READ)
+        except:
+            backing.close()
+            raise
+        return {'buffer': memoryview(mapped), 'backing': (mapped, backing), 'expires': 0}
+
+    def discard(self, asset_ids):
+        """Lets go of assets, e.g. once every platform has been sent the message they belong to."""
+        for asset_id in asset_ids:
+            asset = self._assets.pop(asset_id, None)
+            if asset and asset['backing']:
+                # Readers handed out earlier may still be read, and they hold the buffer and through it the
+                # mapping. The mapping keeps its own handle to the file, so only the file is closed here, and the
+                # mapping is unmapped once the last reader is garbage collected.
+                _mapped, backing = asset['backing']
+                backing.close()
+
+    def sweep(self):
+        now = time.monotonic()
+        self.discard([asset_id for asset_id, asset in self._assets.items() if asset['expires'] <= now])
+
+class ByteBudget:
+    """Caps how many attachment bytes can be in flight at once, from the start of a download until the upload
+    is done with them."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.inflight = 0
+        self._waiters = collections.deque()
+
+    def _fits(self, size):
+        # A file larger than the whole budget can still go through on its own
+        return self.inflight == 0 or self.inflight + size <= self.limit
+
+    async def acquire(self, size):
+        if self._fits(size) and not self._waiters:
+            self.inflight += size
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((size, future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if (size, future) in self._waiters:
+                self._waiters.remove((size, future))
+            elif future.done() and not future.cancelled():
+                # We were handed the bytes, but won't be using them
+                self.release(size)
+            raise
+
+    def release(self, size):
+        self.inflight -= size
+        while self._waiters and self._fits(self._waiters[0][0]):
+            size, future = self._waiters.popleft()
+            if future.done():
+                continue
+            self.inflight += size
+            try:
+                future.set_result(None)
+            except RuntimeError:
+                # The event loop has already been closed
+                pass
+
+    @contextlib.asynccontextmanager
+    async def hold(self, size):
+        await self.acquire(size)
+        try:
+            yield
+        finally:
+            self.release(size)
+
+class AttachmentCache:
+    """Remembers the Autumn IDs of uploaded attachments by content hash, so a file sent to many destinations can
+    be uploaded once. Entries are evicted by age and by the total size of the files they stand for.
+
+    Revolt may only let an upload be attached to one message, so reuse is opt-in and switches itself off if
+    reused uploads keep getting rejected."""
+
+    def __init__(self, max_age=600, max_size=1073741824):
+        self.max_age = max_age
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.reusable = True
+        self._pending = {}
+
+        # Metrics
+        self.uploads = 0
+        self.reuses = 0
+        self.reuse_successes = 0
+        self.reuse_failures = 0
+
+    def evict(self):
+        now = time.monotonic()
+        while self.entries:
+            digest, (_autumn_id, size, uploaded_at) = next(iter(self.entries.items()))
+            if now - uploaded_at < self.max_age and self.size <= self.max_size:
+                break
+            self.entries.pop(digest)
+            self.size -= size
+
+    def discard(self, digest):
+        entry = self.entries.pop(digest, None)
+        if entry:
+            self.size -= entry[1]
+
+    async def resolve(self, digest, size, upload, reuse=True):
+        """Returns (autumn_id, reused) for a file, calling upload if there's no usable upload yet. Concurrent
+        callers for the same file share one upload."""
+        if not (reuse and self.reusable):
+            self.uploads += 1
+            return await upload(), False
+
+        self.evict()
+        entry = self.entries.get(digest)
+        if entry:
+            self.reuses += 1
+            return entry[0], True
+        while digest in self._pending:
+            pending = self._pending[digest]
+            try:
+                autumn_id = await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+                # The upload we were waiting for was cancelled, so take it over unless another waiter already has
+                continue
+            self.reuses += 1
+            return autumn_id, True
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.update({digest: future})
+        try:
+            autumn_id = await upload()
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody else may be waiting, so don't let the exception go unretrieved
+            future.exception()
+            raise
+        except BaseException:
+            # Cancelled, so let the waiters upload the file themselves
+            future.cancel()
+            raise
+        finally:
+            if self._pending.get(digest) is future:
+                self._pending.pop(digest)
+
+        self.uploads += 1
+        future.set_result(autumn_id)
+        self.discard(digest)
+        self.entries.update({digest: (autumn_id, size, time.monotonic())})
+        self.size += size
+        return autumn_id, False
+
+    def reuse_succeeded(self):
+        self.reuse_successes += 1
+
+    def reuse_failed(self, digests):
+        for digest in digests:
+            self.discard(digest)
+        self.reuse_failures += 1
+        if self.reuse_failures >= 3 and self.reuse_successes < self.reuse_failures:
+            # Revolt doesn't seem to accept an upload on more than one message, stop trying
+            self.reusable = False
+
+class LaneBacklogFull(Exception):
+    pass
+
+class SendLane:
+    """Delivers sends for a single destination server in order, so a slow server only delays itself."""
+
+    def __init__(self, server_id, max_backlog=100):
+        self.server_id = server_id
+        self.max_backlog = max_backlog
+        self._jobs = collections.deque()
+        self._worker = None
+
+        # Metrics
+        self.sent = 0
+        self.failed = 0
+        self.rejected = 0
+
+    @property
+    def depth(self):
+        return len(self._jobs)
+
+    @property
+    def age(self):
+        """Returns how long the oldest job in the lane has been waiting, in seconds."""
+        if not self._jobs:
+            return 0
+        return time.monotonic() - self._jobs[0][0]
+
+    def submit(self, func):
+        if len(self._jobs) >= self.max_backlog:
+            self.rejected += 1
+            raise LaneBacklogFull(f'Send lane for server {self.server_id} is full')
+
+        future = asyncio.get_running_loop().create_future()
+        self._jobs.append((time.monotonic(), func, future))
+        if not self._worker or self._worker.done():
+            self._worker = asyncio.create_task(self._work())
+        return future
+
+    async def _work(self):
+        while self._jobs:
+            # Jobs stay in the queue while running, so the lane's age reflects a stalled send
+            _enqueued, func, future = self._jobs[0]
+            try:
+                if not future.done():
+                    result = await func()
+                    self.sent += 1
+                    if not future.done():
+                        future.set_result(result)
+            except Exception as e:
+                self.failed += 1
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self._jobs.popleft()
+
+class CircuitOpen(Exception):
+    pass
+
+class MissingPermissions(Exception):
+    pass
+
+class DuplicateSend(Exception):
+    pass
+
+class CircuitBreaker:
+    """Skips a destination after repeated unavoidable errors, then probes it again with exponential backoff."""
+
+    closed = 'closed'
+    open = 'open'
+    half_open = 'half-open'
+
+    def __init__(self, threshold=3, backoff=30, max_backoff=1800):
+        self.threshold = threshold
+        self.base_backoff = backoff
+        self.max_backoff = max_backoff
+        self.state = self.closed
+        self.failures = 0
+        self.backoff = backoff
+        self.retry_at = 0
+        self.last_error = None
+
+    def allow(self):
+        if self.state == self.closed:
+            return True
+
+        now = time.monotonic()
+        if now < self.retry_at:
+            return False
+
+        # Let one probe through. If it never reports back, another probe is allowed after the backoff.
+        self.state = self.half_open
+        self.retry_at = now + self.backoff
+        return True
+
+    def success(self):
+        self.state = self.closed
+        self.failures = 0
+        self.backoff = self.base_backoff
+        self.last_error = None
+
+    def failure(self, error=None):
+        self.failures += 1
+        self.last_error = error
+        if self.state == self.half_open:
+            # Probe failed, back off further
+            self.backoff = min(self.max_backoff, self.backoff * 2)
+        elif self.failures < self.threshold:
+            return
+        self.state = self.open
+        self.retry_at = time.monotonic() + self.backoff
+
+class SendSpool:
+    """Write-ahead spool for outbound sends, edits and deletes.
+
+    Entries are appended to segment files before they're dispatched, and acknowledged once they complete.
+    Writes are batched, so one fsync covers every entry recorded within the sync interval."""
+
+    def __init__(self, path='revolt_spool', segment_size=4194304, sync_interval=0.02, deadline=600):
+        self.path = path
+        self.segment_size = segment_size
+        self.sync_interval = sync_interval
+        self.deadline = deadline
+        self._segment = 0
+        self._segment_bytes = 0
+        self._segment_counts = {}
+        self._unacked = {}
+        self._buffer = []
+        self._counter = 0
+        self._boot = int(time.time() * 1000)
+        self._task = None
+        self._lock = asyncio.Lock()
+
+    def _segment_path(self, segment):
+        return os.path.join(self.path, f'segment-{segment:08d}.jsonl')
+
+    def _segments(self):
+        segments = []
+        for filename in os.listdir(self.path):
+            if filename.startswith('segment-') and filename.endswith('.jsonl'):
+                try:
+                    segments.append(int(filename[8:-6]))
+                except ValueError:
+                    continue
+        return sorted(segments)
+
+    def load(self):
+        """Reads unacknowledged entries left over from a previous run. Entries older than the deadline are
+        skipped. New entries are written to a fresh segment."""
+        os.makedirs(self.path, exist_ok=True)
+        entries = {}
+        segments = self._segments()
+        for segment in segments:
+            with open(self._segment_path(segment), 'rb') as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Torn write from a crash
+                        continue
+                    if 'ack' in entry:
+                        entries.pop(entry['ack'], None)
+                    else:
+                        entries.update({entry['id']: entry})
+
+        self._segment = segments[-1] + 1 if segments else 0
+        cutoff = time.time() - self.deadline
+        return [entry for entry in entries.values() if entry['ts'] >= cutoff], segments
+
+    def discard(self, segments):
+        """Deletes segments from a previous run once their entries have been replayed."""
+        for segment in segments:
+            try:
+                os.remove(self._segment_path(segment))
+            except FileNotFoundError:
+                pass
+
+    async def record(self, op, data):
+        """Records an operation and waits until it's on disk. Returns the entry ID to acknowledge."""
+        self._counter += 1
+        entry_id = f'{self._boot}-{self._counter}'
+        future = asyncio.get_running_loop().create_future()
+        self._buffer.append((entry_id, json.dumps({'id': entry_id, 'op': op, 'ts': time.time(), 'data': data}), future))
+        self._schedule()
+        await future
+        return entry_id
+
+    def ack(self, entry_id):
+        if not entry_id in self._unacked:
+            return
+        self._buffer.append((entry_id, json.dumps({'ack': entry_id}), None))
+        self._schedule()
+
+    def _schedule(self):
+        if not self._task or self._task.done():
+            self._task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.sync_interval)
+        await self.flush()
+
+    def _write(self, segment, lines):
+        data = ('\n'.join(lines) + '\n').encode('utf-8')
+        with open(self._segment_path(segment), 'ab') as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        return len(data)
+
+    async def flush(self):
+        async with self._lock:
+            while self._buffer:
+                batch = self._buffer
+                self._buffer = []
+                segment = self._segment
+
+                try:
+                    written = await asyncio.get_running_loop().run_in_executor(
+                        None, self._write, segment, [line for _, line, _ in batch]
+                    )
+                except Exception as e:
+                    for _, _, future in batch:
+                        if future and not future.done():
+                            future.set_exception(e)
+                    continue
+
+                self._segment_counts.setdefault(segment, 0)
+                for entry_id, _, future in batch:
+                    if future:
+                        self._unacked.update({entry_id: segment})
+                        self._segment_counts[segment] += 1
+                        if not future.done():
+                            future.set_result(None)
+                    else:
+                        acked_segment = self._unacked.pop(entry_id, None)
+                        if acked_segment is not None:
+                            self._segment_counts[acked_segment] -= 1
+
+                self._segment_bytes += written
+                if self._segment_bytes >= self.segment_size:
+                    self._segment += 1
+                    self._segment_bytes = 0
+
+                # Delete older segments that have nothing left to replay
+                done = [
+                    old for old, count in self._segment_counts.items() if count <= 0 and old < self._segment
+                ]
+                for old in done:
+                    self._segment_counts.pop(old)
+                if done:
+                    await asyncio.get_running_loop().run_in_executor(None, self.discard, done)
+
+class RetryScheduler:
+    """Retries transient failures with jittered exponential backoff.
+
+    Each operation has a deadline, and retries are limited by a budget. Every first attempt earns a fraction of a
+    retry token, and every retry spends one, so only a fixed share of traffic can be retries."""
+
+    def __init__(self, base=0.5, cap=8, deadline=30, budget_ratio=0.2, budget_max=20, retry_after=None):
+        self.base = base
+        self.cap = cap
+        self.deadline = deadline
+        self.budget_ratio = budget_ratio
+        self.budget_max = budget_max
+        self.tokens = budget_max
+        self.counters = collections.Counter()
+
+        # Returns how long the last 429 asked us to wait, if it said
+        self.retry_after = retry_after
+
+    def classify(self, error, status_code=None):
+        """Returns why an error is worth retrying, or None if it isn't."""
+        if status_code == 429:
+            return 'ratelimited'
+        elif type(error) is revolt.errors.ServerError or (status_code is not None and status_code >= 500):
+            return 'server_error'
+        elif isinstance(error, asyncio.TimeoutError):
+            return 'timeout'
+        elif isinstance(error, aiohttp.ClientConnectionError):
+            return 'connection'
+        return None
+
+    async def run(self, op, func, status_code=None, deadline=None):
+        """Runs func, retrying transient failures. status_code should map an exception to its HTTP status."""
+        started = time.monotonic()
+        deadline = deadline or self.deadline
+        self.tokens = min(self.budget_max, self.tokens + self.budget_ratio)
+        attempt = 0
+
+        while True:
+            try:
+                return await func()
+            except Exception as e:
+                cause = self.classify(e, status_code(e) if status_code else None)
+                if not cause:
+                    raise
+                self.counters[f'{op}:{cause}'] += 1
+
+                delay = self.retry_after() if cause == 'ratelimited' and self.retry_after else None
+                if delay is None:
+                    # Nothing told us when to retry (e.g. a 429 without rate limit headers), so back off ourselves
+                    if self.tokens < 1:
+                        self.counters['budget_exhausted'] += 1
+                        raise
+                    self.tokens -= 1
+                    delay = random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+
+                if time.monotonic() - started + delay > deadline:
+                    self.counters['deadline_exceeded'] += 1
+                    raise
+
+                attempt += 1
+                self.counters['retries'] += 1
+                await asyncio.sleep(delay)
+
+class AdaptiveLimiter:
+    """Limits concurrent API calls. The limit grows by one per window of successful calls, and is cut
+    multiplicatively when Revolt responds with 429s, 5xx errors or rising latency."""
+
+    def __init__(self, initial=16, minimum=2, maximum=256, backoff=0.5, cooldown=1):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self.inflight = 0
+        self.latency = None
+        self._waiters = collections.deque()
+        self._last_decrease = 0
+
+        # Metrics
+        self.increases = 0
+        self.decreases = 0
+
+    @property
+    def queued(self):
+        return len(self._waiters)
+
+    async def acquire(self):
+        if self.inflight < int(self.limit) and not self._waiters:
+            self.inflight += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future in self._waiters:
+                self._waiters.remove(future)
+            elif future.done() and not future.cancelled():
+                # We were handed a slot, but won't be using it
+                self.inflight -= 1
+                self._wake()
+            raise
+
+    def suspend(self):
+        """Gives up a slot without counting the call as finished, e.g. while it waits for a rate limit."""
+        self.inflight -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.inflight < int(self.limit):
+            future = self._waiters.popleft()
+            if future.done():
+                continue
+            self.inflight += 1
+            future.set_result(None)
+
+    def release(self, latency, congested=False):
+        self.inflight -= 1
+
+        if not congested and self.latency and latency > self.latency * 3:
+            # Latency is rising, treat it as congestion
+            congested = True
+
+        if congested:
+            # Only decrease once per cooldown, so a burst of errors doesn't collapse the limit
+            if time.monotonic() - self._last_decrease >= self.cooldown:
+                self.limit = max(self.minimum, self.limit * self.backoff)
+                self._last_decrease = time.monotonic()
+                self.decreases += 1
+        else:
+            if self.limit < self.maximum:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+                self.increases += 1
+            self.latency = latency if self.latency is None else self.latency * 0.9 + latency * 0.1
+
+        self._wake()
+
+class Pacing:
+    """Handed to the client's rate limiter for one outbound call. Waiting for a rate limit bucket gives up the
+    call's concurrency slot, and isn't counted towards its latency."""
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self.waited = 0
+
+    async def wait(self, delay):
+        self.limiter.suspend()
+        started = time.monotonic()
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            self.waited += time.monotonic() - started
+            await self.limiter.acquire()
+
 class RevoltPlatform(platform_base.PlatformBase):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.files_per_guild = True
         self.filesize_limit = 20000000
         self.supports_agegate = True
+        self.concurrency = AdaptiveLimiter()
+        self.lanes = {}
+        self.lane_backlog = 100
+        self.circuits = {}
+        self.denials = {}
+        self.denial_ttl = 30
+        self.retry = RetryScheduler(retry_after=self.retry_after)
+        self.upload_cache = AttachmentCache()
+        self.spill_threshold = 8388608
+        self.bandwidth = ByteBudget(209715200)
+        self.assets = AssetStore()
+        self.friendly_memo = collections.OrderedDict()
+        self.friendly_memo_ttl = 10
+        self.friendly_memo_max = 512
+        self.coalesce_batches = {}
+        self.coalesced = collections.OrderedDict()
+        self.coalesced_max = 10000
+        self.coalesce_max_length = 2000
+
+    def is_congestion(self, error):
+        if type(error) in [revolt.errors.ServerError, asyncio.TimeoutError]:
+            return True
+        elif isinstance(error, revolt.errors.HTTPError):
+            status_code = self.status_code(error)
+            return status_code is not None and (status_code == 429 or status_code >= 500)
+        return False
+
+    async def _call(self, func, *args, **kwargs):
+        """Runs an outbound API call under the adaptive concurrency limit."""
+        await self.concurrency.acquire()
+        pacing = Pacing(self.concurrency)
+        token = self.bot.pacing.set(pacing)
+        started = time.monotonic()
+        try:
+            result = await func(*args, **kwargs)
+        except Exception as e:
+            self.concurrency.release(time.monotonic() - started - pacing.waited, congested=self.is_congestion(e))
+            raise
+        except:
+            self.concurrency.release(time.monotonic() - started - pacing.waited)
+            raise
+        finally:
+            self.bot.pacing.reset(token)
+        self.concurrency.release(time.monotonic() - started - pacing.waited)
+        return result
+
+    def retry_after(self):
+        return self.bot.retry_after.get()
+
+    def lane(self, server_id):
+        lane = self.lanes.get(server_id)
+        if not lane:
+            lane = SendLane(server_id, max_backlog=self.lane_backlog)
+            self.lanes.update({server_id: lane})
+        return lane
+
+    def circuit(self, kind, target_id):
+        circuit = self.circuits.get((kind, target_id))
+        if not circuit:
+            # A server's circuit only opens once several of its channels have failed
+            circuit = CircuitBreaker(threshold=3 if kind == 'channel' else 10)
+            self.circuits.update({(kind, target_id): circuit})
+        return circuit
+
+    def check_circuits(self, channel):
+        for kind, target_id in [('server', channel.server.id), ('channel', channel.id)]:
+            if not self.circuit(kind, target_id).allow():
+                raise CircuitOpen(f'Circuit for {kind} {target_id} is open')
+
+    def record_circuits(self, channel, error=None):
+        if error and (
+                type(error) in [CircuitOpen, LaneBacklogFull, MissingPermissions, DuplicateSend] or
+                not self.error_is_unavoidable(error)
+        ):
+            # Only errors that say the destination itself is unusable count against it
+            return
+
+        for kind, target_id in [('server', channel.server.id), ('channel', channel.id)]:
+            if error:
+                self.circuit(kind, target_id).failure(error)
+            else:
+                self.circuit(kind, target_id).success()
+
+    def metrics(self):
+        return {
+            'concurrency_limit': int(self.concurrency.limit),
+            'concurrency_inflight': self.concurrency.inflight,
+            'concurrency_queued': self.concurrency.queued,
+            'concurrency_latency': self.concurrency.latency or 0,
+            'retry_tokens': self.retry.tokens,
+            'retries': dict(self.retry.counters),
+            'attachment_uploads': self.upload_cache.uploads,
+            'attachment_reuses': self.upload_cache.reuse_successes,
+            'attachment_cache_size': self.upload_cache.size,
+            'asset_downloads': self.assets.downloads,
+            'asset_shares': self.assets.shared,
+            'identity_hits': self.bot.identity_cache.hits,
+            'identity_negative_hits': self.bot.identity_cache.negative_hits,
+            'identity_misses': self.bot.identity_cache.misses,
+            'singleflight_calls': self.bot.singleflight.calls,
+            'singleflight_saved': dict(self.bot.singleflight.saved),
+            'lanes': {
+                server_id: {
+                    'depth': lane.depth, 'age': lane.age, 'sent': lane.sent, 'failed': lane.failed,
+                    'rejected': lane.rejected
+                } for server_id, lane in self.lanes.items()
+            }
+        }
 
     def bot_id(self):
         return self.bot.user.id
 
     def error_is_unavoidable(self, error):
-        if type(error) in [revolt.errors.Forbidden, revolt.errors.ServerError]:
+        if type(error) in [revolt.errors.Forbidden, revolt.errors.ServerError, LaneBacklogFull, CircuitOpen,
+                           MissingPermissions, DuplicateSend]:
             return True
         elif type(error) is revolt.errors.HTTPError:
             # if revolt.py is sane, the above statement should cover all of these errors
             # but we'll add this in here just in case it doesn't
-            status_code = int(str(error))
+            status_code = self.status_code(error)
+            if status_code is None:
+                return False
             return status_code >= 500 or status_code == 401 or status_code == 403
         return False
 
+    def _get_identity(self, kind, object_id, getter):
+        """Looks an object up in the client's state, falling back to objects fetched earlier."""
+        try:
+            return getter(object_id)
+        except LookupError:
+            cached = self.bot.identity_cache.get(kind, object_id)
+            if cached is None or cached is self.bot.identity_cache.missing:
+                raise
+            return cached
+
+    async def _fetch_identity(self, kind, object_id, fetch):
+        cache = self.bot.identity_cache
+        cached = cache.get(kind, object_id)
+        if cached is cache.missing:
+            raise LookupError(f'Unknown {kind} {object_id}')
+        elif cached is not None:
+            return cached
+
+        try:
+            result = await self.bot.singleflight.run((kind, object_id), lambda: self._call(fetch, object_id))
+        except revolt.errors.HTTPError as e:
+            if self.status_code(e) == 404:
+                cache.put_missing(kind, object_id)
+            raise
+        cache.put(kind, object_id, result)
+        return result
+
+    async def resolve(self, kind, object_ids):
+        """Resolves users, channels or servers in bulk, fetching any that aren't known concurrently.
+        Returns a dict of the IDs that could be resolved."""
+        getters = {'user': self.get_user, 'channel': self.get_channel, 'server': self.get_server}
+        fetchers = {'user': self.fetch_user, 'channel': self.fetch_channel, 'server': self.fetch_server}
+
+        resolved = {}
+        missing = []
+        for object_id in set(object_ids):
+            try:
+                result = getters[kind](object_id)
+            except LookupError:
+                missing.append(object_id)
+                continue
+            if result:
+                resolved.update({object_id: result})
+
+        fetched = await asyncio.gather(*[fetchers[kind](object_id) for object_id in missing], return_exceptions=True)
+        for object_id, result in zip(missing, fetched):
+            if result and not isinstance(result, BaseException):
+                resolved.update({object_id: result})
+        return resolved
+
     def get_server(self, server_id):
-        return self.bot.get_server(server_id)
+        return self._get_identity('server', server_id, self.bot.get_server)
 
     def get_channel(self, channel_id):
-        return self.bot.get_channel(channel_id)
+        return self._get_identity('channel', channel_id, self.bot.get_channel)
 
     def get_user(self, user_id):
-        return self.bot.get_user(user_id)
+        return self._get_identity('user', user_id, self.bot.get_user)
 
     def get_member(self, server, user_id):
         return server.get_member(user_id)
@@ -150,6 +1108,8 @@ class RevoltPlatform(platform_base.PlatformBase):
         return message.attachments
 
     def url(self, message):
+        # Coalesced copies link to the merged message
+        message = getattr(message, 'message', message)
         return f'https://app.revolt.chat/server/{message.server.id}/channel/{message.channel.id}/{message.id}'
 
     def get_id(self, obj):
@@ -182,10 +1142,7 @@ class RevoltPlatform(platform_base.PlatformBase):
         return user.avatar.url if user.avatar else None
 
     def permissions(self, user, channel=None):
-        if channel:
-            user_perms = user.get_channel_permissions(channel)
-        else:
-            user_perms = user.get_permissions()
+        user_perms = self.bot.permission_cache.permissions(user, channel)
 
         permissions = platform_base.Permissions()
         permissions.ban_members = user_perms.ban_members
@@ -265,13 +1222,63 @@ class RevoltPlatform(platform_base.PlatformBase):
             return content
 
     async def fetch_server(self, server_id):
-        return await self.bot.fetch_server(server_id)
+        return await self._fetch_identity('server', server_id, self.bot.fetch_server)
 
     async def fetch_channel(self, channel_id):
-        return await self.bot.fetch_channel(channel_id)
+        return await self._fetch_identity('channel', channel_id, self.bot.fetch_channel)
+
+    async def fetch_user(self, user_id):
+        return await self._fetch_identity('user', user_id, self.bot.fetch_user)
 
     async def fetch_message(self, channel, message_id):
-        return await channel.fetch_message(message_id)
+        if type(message_id) is str and ':' in message_id:
+            # Part of a coalesced message
+            message_id, index = message_id.split(':', 1)
+            return CoalescedMessage(await self.fetch_message(channel, message_id), int(index))
+        return await self.bot.singleflight.run(
+            ('message', channel.id, message_id), lambda: self._call(channel.fetch_message, message_id)
+        )
+
+    # Everything make_friendly converts, found in a single scan. Subtext and bold headings only count at the
+    # start of a line.
+    friendly_inline = (
+        r'<@!?(?P<user>[0-9A-Za-z]+)>|<#!?(?P<channel>[0-9A-Za-z]+)>|<a?:(?P<emoji>[^:<>\n]+):[^>\n]*>|'
+        r'(?P<spoiler>!!)'
+    )
+    friendly_pattern = re.compile(
+        r'^(?P<subtext>#{5,6}) |^#### (?P<bold>[^\n]*)$|' + friendly_inline, re.MULTILINE
+    )
+    friendly_inline_pattern = re.compile(friendly_inline)
+
+    def _friendly_tokens(self, text, parts, pattern):
+        """Splits text into plain strings and ('user' | 'channel' | 'spoiler', value, raw) tokens."""
+        position = 0
+        for match in pattern.finditer(text):
+            if match.start() > position:
+                parts.append(text[position:match.start()])
+            position = match.end()
+
+            kind = match.lastgroup
+            if kind == 'subtext':
+                parts.append('-# ')
+            elif kind == 'bold':
+                parts.append('**')
+                self._friendly_tokens(match.group('bold'), parts, self.friendly_inline_pattern)
+                parts.append('**')
+            elif kind == 'emoji':
+                parts.append(f':{match.group("emoji")}\\:')
+            else:
+                parts.append((kind, match.group(kind), match.group(0)))
+        if position < len(text):
+            parts.append(text[position:])
+
+    async def resolve_names(self, user_ids=(), channel_ids=()):
+        """Returns names for users and channels as two dicts. Anything that can't be resolved is left out."""
+        users, channels = await asyncio.gather(self.resolve('user', user_ids), self.resolve('channel', channel_ids))
+        return (
+            {user_id: user.display_name or user.name for user_id, user in users.items()},
+            {channel_id: channel.name for channel_id, channel in channels.items()}
+        )
 
     async def make_friendly(self, text, **kwargs):
         # Convert emojis to a URL, if there's only one emoji in the message
@@ -283,108 +1290,138 @@ class RevoltPlatform(platform_base.PlatformBase):
             except:
                 pass
 
-        # Convert pings to regular text
-        components = text.split('<@')
-        offset = 0
-        if text.startswith('<@'):
-            offset = 1
-
-        while offset < len(components):
-            if len(components) == 1 and offset == 0:
-                break
-            userid = components[offset].split('>', 1)[0]
-            try:
-                user = self.bot.get_user(userid)
-                display_name = user.display_name
-            except:
-                offset += 1
-                continue
-            text = text.replace(f'<@{userid}>', f'@{display_name or user.name}').replace(
-                f'<@!{userid}>', f'@{display_name or user.name}')
-            offset += 1
-
-        # Convert channels to regular text
-        components = text.split('<#')
-        offset = 0
-        if text.startswith('<#'):
-            offset = 1
-
-        while offset < len(components):
-            if len(components) == 1 and offset == 0:
-                break
-            channelid = components[offset].split('>', 1)[0]
+        # The same text is usually converted once per destination, so share the result between them
+        memo = self.friendly_memo.get(text)
+        while memo and memo[0] > time.monotonic():
             try:
-                try:
-                    channel = self.bot.get_channel(channelid)
-                except:
-                    channel = await self.bot.fetch_channel(channelid)
-                if not channel:
-                    raise ValueError()
-            except:
-                offset += 1
-                continue
-            text = text.replace(f'<#{channelid}>', f'#{channel.name}').replace(
-                f'<#!{channelid}>', f'#{channel.name}')
-            offset += 1
-
-        # Convert emojis to regular text
-        components = text.split('<:')
-        offset = 0
-        if text.startswith('<:'):
-            offset = 1
-
-        while offset < len(components):
-            if len(components) == 1 and offset == 0:
-                break
-            emojiname = components[offset].split(':', 1)[0]
-            emojiafter = components[offset].split(':', 1)[1].split('>')[0] + '>'
-            text = text.replace(f'<:{emojiname}:{emojiafter}', f':{emojiname}\\:')
-            offset += 1
-
-        # Convert animated emojis to regular text
-        components = text.split('<a:')
-        offset = 0
-        if text.startswith('<a:'):
-            offset = 1
-
-        while offset < len(components):
-            if len(components) == 1 and offset == 0:
-                break
-            emojiname = components[offset].split(':', 1)[0]
-            emojiafter = components[offset].split(':', 1)[1].split('>')[0] + '>'
-            text = text.replace(f'<a:{emojiname}:{emojiafter}', f':{emojiname}\\:')
-            offset += 1
-
-        # Convert subtext to Revolt format
-        components = text.split('\n')
-        newlines = []
-        for line in components:
-            if line.startswith('##### ') or line.startswith('###### '):
-                tags = line.split(' ', 1)[0]
-                line = line.replace(f'{tags} ', '-# ', 1)
-            elif line.startswith('#### '):
-                line = line.replace('#### ', '**', 1) + '**'
-            newlines.append(line)
+                return await asyncio.shield(memo[1])
+            except asyncio.CancelledError:
+                if not memo[1].cancelled():
+                    raise
+                # The conversion we were waiting for was cancelled, so take it over unless another caller already has
+                memo = self.friendly_memo.get(text)
 
-        text = '\n'.join(newlines)
+        future = asyncio.get_running_loop().create_future()
+        self.friendly_memo.update({text: (time.monotonic() + self.friendly_memo_ttl, future)})
+        self.friendly_memo.move_to_end(text)
+        while len(self.friendly_memo) > self.friendly_memo_max:
+            self.friendly_memo.popitem(last=False)
 
-        # Convert spoilers to Discord format
-        components = text.split('!!')
-        to_replace = (len(components) - 1) - ((len(components) - 1) % 2)
-        text = text.replace('!!', '||', to_replace)
+        try:
+            result = await self._make_friendly(text)
+        except BaseException as e:
+            if self.friendly_memo.get(text, (0, None))[1] is future:
+                self.friendly_memo.pop(text)
+            if isinstance(e, Exception):
+                future.set_exception(e)
+                future.exception()
+            else:
+                # Cancelled, so let the waiters convert the text themselves
+                future.cancel()
+            raise
+        future.set_result(result)
+        return result
+
+    async def _make_friendly(self, text):
+        parts = []
+        self._friendly_tokens(text, parts, self.friendly_pattern)
+
+        tokens = [part for part in parts if type(part) is tuple]
+        users, channels = await self.resolve_names(
+            {value for kind, value, _raw in tokens if kind == 'user'},
+            {value for kind, value, _raw in tokens if kind == 'channel'}
+        )
+
+        # Convert spoilers to Discord format, leaving an unpaired marker alone
+        spoilers = sum(1 for kind, _value, _raw in tokens if kind == 'spoiler')
+        to_replace = spoilers - spoilers % 2
+
+        output = []
+        for part in parts:
+            if type(part) is str:
+                output.append(part)
+                continue
 
-        return text
+            kind, value, raw = part
+            if kind == 'user':
+                output.append(f'@{users[value]}' if value in users else raw)
+            elif kind == 'channel':
+                output.append(f'#{channels[value]}' if value in channels else raw)
+            elif to_replace > 0:
+                output.append('||')
+                to_replace -= 1
+            else:
+                output.append(raw)
+        return ''.join(output)
 
     async def to_discord_file(self, file):
-        filebytes = await file.read()
-        return nextcord.File(fp=BytesIO(filebytes), filename=file.filename, force_close=False)
+        async def download_to(fp):
+            async with self.bot.bot.revolt_session.get(file.url) as response:
+                response.raise_for_status()
+                async for chunk in response.content.iter_chunked(262144):
+                    await asyncio.to_thread(fp.write, chunk)
+
+        reader = await self.assets.reader(
+            file.id, file.size, lambda: self._call(file.read), lambda fp: self._call(download_to, fp)
+        )
+        return nextcord.File(fp=reader, filename=file.filename, force_close=False)
 
     async def to_platform_file(self, file: Union[nextcord.Attachment, nextcord.File]):
         if type(file) is nextcord.Attachment:
-            f = await file.to_file(use_cached=True)
+            try:
+                return await self.relay_attachment(file)
+            except aiohttp.ClientError:
+                f = await file.to_file(use_cached=True)
         else:
             f = file
-        return revolt.File(f.fp.read(), filename=f.filename)
+        return RelayedFile(f.fp, f.filename)
+
+    async def relay_attachment(self, attachment: nextcord.Attachment):
+        """Downloads a Discord attachment in chunks, spilling it to disk once it's larger than spill_threshold."""
+        spooled = tempfile.SpooledTemporaryFile(max_size=self.spill_threshold)
+        written = 0
+
+        # The bytes stay reserved until the relayed file is released, so files waiting to be uploaded count too
+        await self.bandwidth.acquire(attachment.size)
+        try:
+            async with self.bot.bot.revolt_session.get(attachment.proxy_url or attachment.url) as response:
+                response.raise_for_status()
+                async for chunk in response.content.iter_chunked(262144):
+                    written += len(chunk)
+                    if written > self.spill_threshold:
+                        # Spilled to disk, so don't block the event loop on the write
+                        await asyncio.to_thread(spooled.write, chunk)
+                    else:
+                        spooled.write(chunk)
+        except:
+            self.bandwidth.release(attachment.size)
+            spooled.close()
+            raise
+        spooled.seek(0)
+        return RelayedFile(
+            spooled, attachment.filename, size=attachment.size, spoiler=attachment.is_spoiler(), budget=self.bandwidth
+        )
+
+    async def upload(self, file):
+        """Uploads a file to Autumn, streaming it from memory or disk rather than reading it all at once."""
+        http = self.bot.http
+        form = aiohttp.FormData()
+        form.add_field('file', file.chunks(), filename=file.filename)
+
+        async def post():
+            async with self.bot.bot.revolt_session.post(
+                    f'{http.api_info["features"]["autumn"]["url"]}/attachments', data=form,
+                    headers={'x-bot-token': http.token}
+            ) as response:
+                if response.status >= 400:
+                    raise revolt.errors.HTTPError(response.status)
+                return (await response.json())['id']
+
+        if file.reserved:
+            # Relayed files already hold their bytes in the budget
+            return await post()
+        async with self.bandwidth.hold(file.size):
+            return await post()
 
     def file_name(self, attachment: revolt.Asset):
         """Returns the filename of an attachment."""
@@ -394,20 +1431,140 @@ class RevoltPlatform(platform_base.PlatformBase):
         """Returns the URL of an attachment."""
         return attachment.url
 
-    async def send(self, channel, content, special: dict = None):
-        persona = None
-        bucket_type = None
-
-        if hasattr(self, 'buckets'):
-            bucket_type = platform_base.RateLimit
+    @staticmethod
+    def status_code(error):
+        try:
+            return int(str(error))
+        except ValueError:
+            return None
+
+    def http_status(self, error):
+        if isinstance(error, revolt.errors.HTTPError):
+            return self.status_code(error)
+        return None
+
+    @staticmethod
+    def variant_key(idempotency_key, variant):
+        """Derives the key for a deliberately different resend of a copy. Revolt remembers a key as soon as it
+        sees it, so reusing it for a changed payload would be rejected as a duplicate."""
+        if not idempotency_key:
+            return None
+        return hashlib.sha256(f'{idempotency_key}:{variant}'.encode('utf-8')).hexdigest()[:32]
+
+    async def _send(self, channel, content, idempotency_key=None, attachments=None, **kwargs):
+        if attachments:
+            # Attachments are sent by Autumn ID, so uploads can be shared between destinations
+            return await self._send_files(attachments, idempotency_key, lambda attachment_ids, key: self._send_raw(
+                channel, f'/channels/{channel.id}/messages', content, attachment_ids, idempotency_key=key, **kwargs
+            ))
+        return await self._keyed_send(
+            channel, idempotency_key, lambda: self._call(channel.send, content, **kwargs)
+        )
+
+    async def _send_webhook(self, channel, webhook, content, idempotency_key=None, attachments=None, **kwargs):
+        """Sends a message through the channel's webhook, which has its own rate limit buckets."""
+        route = f'/webhooks/{webhook["id"]}/{webhook["token"]}'
+        if attachments:
+            return await self._send_files(attachments, idempotency_key, lambda attachment_ids, key: self._send_raw(
+                channel, route, content, attachment_ids, idempotency_key=key, **kwargs
+            ))
+        return await self._send_raw(channel, route, content, None, idempotency_key=idempotency_key, **kwargs)
+
+    async def _send_raw(self, channel, route, content, attachment_ids, idempotency_key=None, embeds=None,
+                        reply=None, masquerade=None):
+        payload = {'content': content}
+        if embeds:
+            payload.update({'embeds': [embed.to_dict() for embed in embeds]})
+        if attachment_ids:
+            payload.update({'attachments': attachment_ids})
+        if reply:
+            payload.update({'replies': [reply.to_dict()]})
+        if masquerade:
+            payload.update({'masquerade': masquerade.to_dict()})
+
+        data = await self._keyed_send(channel, idempotency_key, lambda: self._call(
+            self.bot.http.request, 'POST', route, json=payload
+        ))
+        if data.get('author') != self.bot_id():
+            # Webhook messages are authored by the webhook, which revolt.py can't look up as a server member. The
+            # copy only needs to be identifiable, so attribute it to the bot.
+            data = dict(data, author=self.bot_id())
+        return self.bot.state.add_message(data)
+
+    async def upload_files(self, files, reuse=True):
+        """Uploads files to Autumn. If revolt_reuse_uploads is enabled, earlier uploads of identical files are
+        reused. Returns (digest, autumn_id, reused) for each file."""
+        reuse = reuse and self.upload_cache.reusable and self.bot.bot.config.get('revolt_reuse_uploads', False)
+        uploads = []
+        for file in files:
+            if not type(file) is RelayedFile:
+                file = RelayedFile(file.f, file.filename, spoiler=getattr(file, 'spoiler', False))
+            digest = None
+            if reuse:
+                async with file.lock:
+                    digest = await file.hash()
+
+            async def upload(file=file):
+                # Destinations share the file, so only one of them can read it at a time
+                async with file.lock:
+                    return await self._call(self.upload, file)
+
+            autumn_id, reused = await self.upload_cache.resolve(digest, file.size, upload, reuse=reuse)
+            uploads.append((digest, autumn_id, reused))
+        return uploads
+
+    async def _send_files(self, files, idempotency_key, send):
+        """Sends a message with attachments. If Revolt rejects a reused upload, the files are uploaded again."""
+        uploads = await self.upload_files(files)
+        reused = [digest for digest, _autumn_id, was_reused in uploads if was_reused]
+        try:
+            result = await send([autumn_id for _digest, autumn_id, _reused in uploads], idempotency_key)
+        except revolt.errors.HTTPError as e:
+            status_code = self.status_code(e)
+            if not reused or self.retry.classify(e, status_code) or status_code in [401, 403, 404, 409]:
+                raise
+        else:
+            if reused:
+                self.upload_cache.reuse_succeeded()
+            return result
+
+        self.upload_cache.reuse_failed(reused)
+        uploads = await self.upload_files(files, reuse=False)
+        return await send(
+            [autumn_id for _digest, autumn_id, _reused in uploads], self.variant_key(idempotency_key, 'reupload')
+        )
+
+    async def _keyed_send(self, channel, idempotency_key, func):
+        token = self.bot.idempotency_key.set(idempotency_key) if idempotency_key else None
+        try:
+            return await self.retry.run('send', func, status_code=self.http_status)
+        except revolt.errors.HTTPError as e:
+            if idempotency_key and self.status_code(e) == 409:
+                # An earlier attempt already went through
+                raise DuplicateSend(f'Message was already sent to channel {channel.id}') from e
+            raise
+        finally:
+            if token:
+                self.bot.idempotency_key.reset(token)
+
+    @staticmethod
+    def to_revolt_markdown(content):
+        newlines = []
+        for line in content.split('\n'):
+            if line.startswith('-# '):
+                line = line.replace('-# ', '##### ', 1)
+            newlines.append(line)
+        content = '\n'.join(newlines)
 
-        bucket: Optional[bucket_type] = None
-        if hasattr(self, 'buckets'):
-            bucket = self.buckets.get(f'/channels/{channel.id}/messages')
+        # Convert spoilers to Revolt format
+        components = content.split('||')
+        to_replace = (len(components) - 1) - ((len(components) - 1) % 2)
+        return content.replace('||', '!!', to_replace)
 
-            if not bucket:
-                bucket = platform_base.RateLimit(f'/channels/{channel.id}/messages', 10, 10)
-                self.buckets.update({f'/channels/{channel.id}/messages': bucket})
+    def prepare(self, content, special: dict = None):
+        """Prepares a message's content, masquerade, embeds and attachments once for all destinations."""
+        special = special or {}
+        prepared = PreparedMessage(content, special)
 
         def to_color(color):
             try:
@@ -426,157 +1583,393 @@ class RevoltPlatform(platform_base.PlatformBase):
             elif 'emoji' in special['bridge'].keys():
                 if type(special['bridge']['emoji']) is str:
                     name = name + ' ' + special['bridge']['emoji']
-            persona = revolt.Masquerade(
+            prepared.persona = revolt.Masquerade(
                 name=name,
                 avatar=special['bridge']['avatar'] if 'avatar' in special['bridge'].keys() else None,
                 colour=to_color(special['bridge']['color']) if 'color' in special['bridge'].keys() else None
             )
 
-            try:
-                me = channel.server.get_member(self.bot.user.id)
-            except:
-                me = await channel.server.fetch_member(self.bot.user.id)
+        if special and special.get('source', 'discord') == 'discord':
+            prepared.content = self.to_revolt_markdown(content)
 
-            if not me.get_permissions().manage_role:
-                persona.colour = None
-        if not special:
-            if hasattr(self, 'buckets'):
-                await self.handle_ratelimit(bucket)
+        return prepared
 
-            while True:
-                try:
-                    msg = await channel.send(content)
-                    break
-                except revolt.errors.HTTPError as e:
-                    if '429' in str(e) and hasattr(self, 'buckets'):
-                        bucket.force_ratelimit()
-                        await self.handle_ratelimit(bucket)
-                    else:
-                        raise
-                except:
-                    raise
+    async def resolve_reply(self, channel, reply):
+        """Returns the message being replied to in the destination channel, if any."""
+        reply_id = None
+        if type(reply) is revolt.Message:
+            # noinspection PyUnresolvedReferences
+            reply_id = reply.id
+        elif type(reply) is str:
+            reply_id = reply
         else:
-            reply_id = None
-            reply = special.get('reply', None)
-            source = special.get('source', 'discord')
-
-            if reply:
-                if type(reply) is revolt.Message:
+            # probably UnifierMessage, if not then ignore
+            try:
+                # noinspection PyUnresolvedReferences
+                if reply.channel_id == channel.id:
                     # noinspection PyUnresolvedReferences
                     reply_id = reply.id
-                elif type(reply) is str:
-                    reply_id = reply
+                elif reply.source == 'revolt':
+                    # noinspection PyUnresolvedReferences
+                    reply_id = reply.copies[channel.server.id][1]
                 else:
-                    # probably UnifierMessage, if not then ignore
-                    try:
-                        # noinspection PyUnresolvedReferences
-                        if reply.channel_id == channel.id:
-                            # noinspection PyUnresolvedReferences
-                            reply_id = reply.id
-                        elif reply.source == 'revolt':
-                            # noinspection PyUnresolvedReferences
-                            reply_id = reply.copies[channel.server.id][1]
-                        else:
-                            # noinspection PyUnresolvedReferences
-                            reply_id = reply.external_copies['revolt'][channel.server.id][1]
-                    except:
-                        pass
-
-            reply_msg = None
-
-            if reply_id:
-                try:
-                    reply_msg = self.bot.get_message(reply_id)
-                except:
-                    try:
-                        reply_msg = await channel.fetch_message(reply_id)
-                    except:
-                        pass
-
-            if source == 'discord':
-                newlines = []
-                for line in content.split('\n'):
-                    if line.startswith('-# '):
-                        line = line.replace('-# ', '##### ', 1)
-                    newlines.append(line)
-                content = '\n'.join(newlines)
-
-                # Convert spoilers to Revolt format
-                components = content.split('||')
-                to_replace = (len(components) - 1) - ((len(components) - 1) % 2)
-                content = content.replace('||', '!!', to_replace)
+                    # noinspection PyUnresolvedReferences
+                    reply_id = reply.external_copies['revolt'][channel.server.id][1]
+            except:
+                pass
+
+        if not reply_id:
+            return None
 
+        # Replies to a coalesced copy target the merged message
+        reply_id = reply_id.split(':', 1)[0]
+        try:
+            return self.bot.get_message(reply_id)
+        except:
             try:
-                if hasattr(self, 'buckets'):
-                    await self.handle_ratelimit(bucket)
+                return await self.fetch_message(channel, reply_id)
+            except:
+                return None
 
-                while True:
-                    try:
-                        msg = await channel.send(
-                            content,
-                            embeds=special['embeds'] if 'embeds' in special.keys() else None,
-                            attachments=special['files'] if 'files' in special.keys() else None,
-                            reply=revolt.MessageReply(reply_msg) if reply_id else None,
-                            masquerade=persona
-                        )
-                        break
-                    except revolt.errors.HTTPError as e:
-                        if '429' in str(e) and hasattr(self, 'buckets'):
-                            bucket.force_ratelimit()
-                            await self.handle_ratelimit(bucket)
-                        else:
-                            raise
-                    except:
+    async def _spooled(self, op, data, func):
+        """Runs an operation, recording it in the write-ahead spool first if the spool is enabled."""
+        spool = getattr(self.bot, 'spool', None)
+        entry_id = None
+        if spool:
+            try:
+                entry_id = await spool.record(op, data)
+            except:
+                # The spool is best-effort, don't drop the operation because the disk is unhappy
+                pass
+
+        try:
+            result = await func()
+        except Exception:
+            if entry_id:
+                spool.ack(entry_id)
+            raise
+
+        # Cancelled operations are deliberately left unacknowledged so they're replayed on the next boot
+        if entry_id:
+            spool.ack(entry_id)
+        return result
+
+    @staticmethod
+    def spool_embeds(embeds):
+        if not embeds:
+            return None
+        return [
+            {
+                'title': embed.title, 'description': embed.description, 'url': embed.url,
+                'icon_url': embed.icon_url, 'colour': embed.colour
+            } for embed in embeds
+        ]
+
+    async def replay(self, entry):
+        """Replays an operation left unacknowledged in the spool by a previous run."""
+        data = entry['data']
+        try:
+            channel = self.get_channel(data['channel'])
+        except:
+            channel = await self.fetch_channel(data['channel'])
+
+        if entry['op'] == 'send':
+            reply = None
+            if data['reply']:
+                try:
+                    reply = revolt.MessageReply(await self.fetch_message(channel, data['reply']))
+                except:
+                    pass
+            await self._spooled('send', data, lambda: self._send(
+                channel,
+                data['content'],
+                idempotency_key=data.get('key'),
+                embeds=[revolt.SendableEmbed(**embed) for embed in data['embeds']] if data['embeds'] else None,
+                reply=reply,
+                masquerade=revolt.Masquerade(**data['masquerade']) if data['masquerade'] else None
+            ))
+        elif entry['op'] == 'edit':
+            message = await self.fetch_message(channel, data['message'])
+            await self._spooled('edit', data, lambda: self.retry.run(
+                'edit', lambda: self._call(message.edit, content=data['content']), status_code=self.http_status
+            ))
+        elif entry['op'] == 'delete':
+            message = await self.fetch_message(channel, data['message'])
+            await self._spooled('delete', data, lambda: self.retry.run(
+                'delete', lambda: self._call(message.delete), status_code=self.http_status
+            ))
+
+    async def _send_prepared(self, channel, prepared, files=None):
+        # Check cached permissions first, so we don't spend a round trip just to get a 403
+        permissions = await self.bot.own_permissions(channel.server, channel)
+        if not getattr(permissions, 'send_messages', True):
+            # A denial is never corrected by a Forbidden, so recompute it every so often in case an update was missed
+            if self.denials.get(channel.id, 0) <= time.monotonic():
+                self.bot.permission_cache.invalidate_channel(channel.server.id, channel.id)
+                permissions = await self.bot.own_permissions(channel.server, channel)
+                self.denials.update({channel.id: time.monotonic() + self.denial_ttl})
+            if not getattr(permissions, 'send_messages', True):
+                raise MissingPermissions(f'Missing Send Messages permission in channel {channel.id}')
+        self.denials.pop(channel.id, None)
+
+        key = prepared.idempotency_key(channel)
+        if not prepared.special:
+            return await self._spooled(
+                'send', {'channel': channel.id, 'content': prepared.content, 'masquerade': None, 'reply': None,
+                         'embeds': None, 'key': key},
+                lambda: self._send(channel, prepared.content, idempotency_key=key)
+            )
+
+        content = prepared.content
+        embeds = prepared.embeds
+        persona = prepared.persona
+        if files and not getattr(permissions, 'upload_files', True):
+            files = None
+        if embeds and not getattr(permissions, 'send_embeds', True):
+            embeds = None
+        if persona and not getattr(permissions, 'masquerade', True):
+            # Without masquerade, the message would look like it came from the bot
+            content = f'**{persona.name}**: {content}'
+            persona = None
+        if persona and persona.colour and not (await self.bot.own_permissions(channel.server)).manage_role:
+            persona = revolt.Masquerade(name=persona.name, avatar=persona.avatar)
+
+        reply_msg = None
+        if prepared.reply:
+            reply_msg = await self.resolve_reply(channel, prepared.reply)
+
+        webhook = self.bot.get_webhook(channel.id)
+
+        async def send_copy():
+            if webhook:
+                try:
+                    return await self._send_webhook(
+                        channel,
+                        webhook,
+                        content,
+                        idempotency_key=key,
+                        embeds=embeds,
+                        attachments=files,
+                        reply=revolt.MessageReply(reply_msg) if reply_msg else None,
+                        masquerade=persona
+                    )
+                except (revolt.errors.HTTPError, revolt.errors.Forbidden) as e:
+                    if not (type(e) is revolt.errors.Forbidden or self.status_code(e) in [401, 403, 404]):
                         raise
+                    # The webhook was deleted or revoked, so fall back to masquerade sends
+                    await self.bot.remove_webhook(channel.id, revoke=False)
+
+            try:
+                return await self._send(
+                    channel,
+                    content,
+                    idempotency_key=key,
+                    embeds=embeds,
+                    attachments=files,
+                    reply=revolt.MessageReply(reply_msg) if reply_msg else None,
+                    masquerade=persona
+                )
             except Exception as e:
                 if str(e) == 'Expected object or value':
-                    if hasattr(self, 'buckets'):
-                        await self.handle_ratelimit(bucket)
-
-                    while True:
-                        try:
-                            msg = await channel.send(
-                                content,
-                                embeds=special['embeds'] if 'embeds' in special.keys() else None,
-                                reply=revolt.MessageReply(reply_msg) if reply_id else None,
-                                masquerade=persona
-                            )
-                            break
-                        except revolt.errors.HTTPError as e:
-                            if '429' in str(e) and hasattr(self, 'buckets'):
-                                bucket.force_ratelimit()
-                                await self.handle_ratelimit(bucket)
-                            else:
-                                raise
-                        except:
-                            raise
+                    return await self._send(
+                        channel,
+                        content,
+                        idempotency_key=self.variant_key(key, 'no_attachments'),
+                        embeds=embeds,
+                        reply=revolt.MessageReply(reply_msg) if reply_msg else None,
+                        masquerade=persona
+                    )
+                raise
+
+        # Attachments aren't spooled, a replayed copy is sent without them
+        return await self._spooled('send', {
+            'channel': channel.id,
+            'content': content,
+            'masquerade': {
+                'name': persona.name, 'avatar': persona.avatar, 'colour': persona.colour
+            } if persona else None,
+            'reply': reply_msg.id if reply_msg else None,
+            'embeds': self.spool_embeds(embeds),
+            'key': key
+        }, send_copy)
+
+    def coalescing(self, channel):
+        """Returns the coalescing window in seconds for the channel's room, or None if it's not enabled."""
+        config = self.bot.bot.config
+        rooms = config.get('revolt_coalesce_rooms', [])
+        if not rooms:
+            return None
+
+        room_index = getattr(self.bot, 'room_index', None)
+        room = room_index.get(channel.server.id, channel.id) if room_index else None
+        if not room in rooms:
+            return None
+        return config.get('revolt_coalesce_window', 350) / 1000
+
+    @staticmethod
+    def coalesce_key(prepared):
+        """Returns the key messages must share to be merged, or None if the message can't be merged."""
+        if prepared.files or prepared.embeds or prepared.reply or not prepared.persona or not prepared.content:
+            return None
+        persona = prepared.persona
+        return persona.name, persona.avatar, persona.colour
+
+    def render_coalesced(self, parts):
+        return '\n'.join([part for part in parts if part is not None])
+
+    def _flush_coalesced(self, channel, batch):
+        """Closes a batch and queues its merged copy on the channel's lane."""
+        if batch.closed:
+            return
+        batch.closed = True
+        if self.coalesce_batches.get(channel.id) is batch:
+            self.coalesce_batches.pop(channel.id)
+
+        # The first message's idempotency key is reused, so retries of the merged copy are still deduplicated
+        merged = PreparedMessage(
+            self.render_coalesced(batch.parts), batch.prepared.special, parent_id=batch.prepared.parent_id
+        )
+        merged.persona = batch.prepared.persona
+        try:
+            sent = self.lane(channel.server.id).submit(lambda: self._send_prepared(channel, merged))
+        except Exception as e:
+            batch.future.set_exception(e)
+            return
+
+        def done(future):
+            if future.exception():
+                batch.future.set_exception(future.exception())
+                return
+            message = future.result()
+            self.coalesced.update({message.id: list(batch.parts)})
+            while len(self.coalesced) > self.coalesced_max:
+                self.coalesced.popitem(last=False)
+            batch.future.set_result(message)
+
+        sent.add_done_callback(done)
+
+    async def _send_coalesced(self, channel, prepared, window, files=None):
+        """Sends a message as part of a batch, merging it with the author's other messages in the window."""
+        key = self.coalesce_key(prepared)
+        batch = self.coalesce_batches.get(channel.id)
+        if batch and (key is None or batch.key != key or
+                      batch.length + len(prepared.content) + 1 > self.coalesce_max_length):
+            # Another author spoke or the batch is full, so send what we have first to keep messages in order
+            self._flush_coalesced(channel, batch)
+            batch = None
+
+        if key is None:
+            return await self.lane(channel.server.id).submit(
+                lambda: self._send_prepared(channel, prepared, files=files)
+            )
+
+        if not batch:
+            batch = CoalesceBatch(key, prepared)
+            self.coalesce_batches.update({channel.id: batch})
+            asyncio.get_running_loop().call_later(window, self._flush_coalesced, channel, batch)
+
+        index = batch.add(prepared.content)
+        return CoalescedMessage(await asyncio.shield(batch.future), index)
+
+    async def send_many(self, channels, content, special: dict = None):
+        """Sends a message to multiple channels concurrently. Content is only prepared once.
+
+        Returns a dict of channel IDs to either the sent message or the exception raised for that channel."""
+        prepared = self.prepare(content, special)
+        files = prepared.files_for()
+
+        async def send_one(channel):
+            try:
+                self.check_circuits(channel)
+                window = self.coalescing(channel)
+                if window:
+                    result = await self._send_coalesced(channel, prepared, window, files=files)
                 else:
-                    raise
-        return msg
+                    result = await self.lane(channel.server.id).submit(
+                        lambda: self._send_prepared(channel, prepared, files=files)
+                    )
+            except Exception as e:
+                if type(e) is revolt.errors.Forbidden:
+                    # Our cached permissions were wrong, recompute them next time
+                    self.bot.permission_cache.invalidate_channel(channel.server.id, channel.id)
+                self.record_circuits(channel, e)
+                return channel, e
+            self.record_circuits(channel)
+            self.register_copy(channel, result)
+            return channel, result
+
+        try:
+            results = await asyncio.gather(*[send_one(channel) for channel in channels])
+        finally:
+            # Every destination is done with the files, so their bytes can go back to the budget
+            for file in files or []:
+                file.release()
+        return {channel.id: result for channel, result in results}
+
+    def register_copy(self, channel, message):
+        """Registers a delivered copy on the message being fanned out, if any, so replies to it can find this
+        copy while slower destinations are still being sent to."""
+        parent = self.bot.fanout_parent.get()
+        if not parent:
+            return
+        copy = [channel.id, message.id]
+        if parent.source == 'revolt':
+            parent.copies.update({channel.server.id: copy})
+        else:
+            parent.external_copies.setdefault('revolt', {}).update({channel.server.id: copy})
+
+    async def send(self, channel, content, special: dict = None):
+        result = (await self.send_many([channel], content, special))[channel.id]
+        if isinstance(result, BaseException):
+            raise result
+        return result
 
     async def edit(self, message, content, source: str = 'discord', special: dict = None):
         if source == 'discord':
-            newlines = []
-            for line in content.split('\n'):
-                if line.startswith('-# '):
-                    line = line.replace('-# ', '##### ', 1)
-                newlines.append(line)
-            content = '\n'.join(newlines)
-
-            # Convert spoilers to Revolt format
-            components = content.split('||')
-            to_replace = (len(components) - 1) - ((len(components) - 1) % 2)
-            content = content.replace('||', '!!', to_replace)
-
+            content = self.to_revolt_markdown(content)
+
+        if type(message) is CoalescedMessage:
+            # Only replace this message's part of the merged copy
+            parts = self.coalesced.get(message.message.id)
+            if not parts or message.index >= len(parts):
+                # We no longer know the other parts (e.g. after a restart), and editing would overwrite them
+                self.bot.logger.warning(f'Skipped edit of coalesced message {message.id}, its other parts are unknown')
+                return
+            parts[message.index] = content
+            content = self.render_coalesced(parts)
+            message = message.message
+            special = None
+
+        data = {'channel': message.channel.id, 'message': message.id, 'content': content}
         if not special:
-            await message.edit(
+            await self._spooled('edit', data, lambda: self.retry.run('edit', lambda: self._call(
+                message.edit,
                 content=content
-            )
+            ), status_code=self.http_status))
         else:
-            await message.edit(
+            await self._spooled('edit', data, lambda: self.retry.run('edit', lambda: self._call(
+                message.edit,
                 content=content,
                 embeds=special['embeds'] if 'embeds' in special.keys() else None
-            )
+            ), status_code=self.http_status))
 
     async def delete(self, message):
-        await message.delete()
+        if type(message) is CoalescedMessage:
+            parts = self.coalesced.get(message.message.id)
+            if not parts or message.index >= len(parts):
+                # Deleting would take the other parts of the merged copy with it
+                self.bot.logger.warning(
+                    f'Skipped delete of coalesced message {message.id}, its other parts are unknown'
+                )
+                return
+            parts[message.index] = None
+            if any(part is not None for part in parts):
+                # Other parts of the merged copy remain, so only remove this one
+                return await self.edit(message.message, self.render_coalesced(parts), source='revolt')
+            self.coalesced.pop(message.message.id, None)
+            message = message.message
+
+        await self._spooled(
+            'delete', {'channel': message.channel.id, 'message': message.id},
+            lambda: self.retry.run('delete', lambda: self._call(message.delete), status_code=self.http_status)
+        )